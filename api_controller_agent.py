@@ -1,6 +1,12 @@
+import asyncio
+import time
+
+from concurrent.futures import FIRST_COMPLETED, wait
 from typing import (
     Annotated,
+    Any,
     Callable,
+    Dict,
     Optional,
     Sequence,
     Type,
@@ -9,13 +15,21 @@ from typing import (
     Union,
 )
 
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
 from langchain_core.language_models import LanguageModelLike
 from langchain_core.messages import (
     AIMessage,
     BaseMessage,
     SystemMessage,
+    ToolCall,
+    ToolMessage,
 )
 from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import (
+    ContextThreadPoolExecutor,
+    get_callback_manager_for_config,
+    get_config_list,
+)
 from langchain_core.tools import BaseTool
 
 from langgraph.checkpoint.base import BaseCheckpointSaver
@@ -42,6 +56,13 @@ StateSchemaType = Type[StateSchema]
 
 STATE_MODIFIER_RUNNABLE_NAME = "StateModifier"
 
+# Custom event carrying each ToolMessage as soon as its tool call finishes
+TOOL_RESULT_EVENT = "tool_result"
+
+TOOL_TIMEOUT_ERROR_TEMPLATE = (
+    "Error: {tool} did not answer within {timeout} seconds.\n Please try again."
+)
+
 StateModifier = Union[
     SystemMessage,
     str,
@@ -81,6 +102,127 @@ def _get_state_modifier_runnable(state_modifier: Optional[StateModifier]) -> Run
     return state_modifier_runnable
 
 
+def _has_parent_run(config: RunnableConfig) -> bool:
+    # Custom events need a run to attach to, e.g. not when the node is invoked alone
+    return get_callback_manager_for_config(config).parent_run_id is not None
+
+
+class ConcurrentToolNode(ToolNode):
+    """`ToolNode` running the tool calls of one AIMessage concurrently.
+
+    At most `max_concurrency` calls run at once and each call is given up on
+    after its tool's entry in `tool_timeouts`, or `tool_timeout`, seconds.
+    Every ToolMessage is dispatched as a `TOOL_RESULT_EVENT` custom event as
+    soon as it is ready, so `astream_events` consumers see partial results,
+    when the node runs within a parent run.
+    A timed out sync tool keeps running in its thread, its result is dropped.
+    """
+
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        *,
+        max_concurrency: int = 4,
+        tool_timeout: Optional[float] = None,
+        tool_timeouts: Optional[Dict[str, float]] = None,
+        name: str = "tools",
+        tags: Optional[list[str]] = None,
+        handle_tool_errors: Optional[bool] = True,
+    ) -> None:
+        super().__init__(
+            tools, name=name, tags=tags, handle_tool_errors=handle_tool_errors
+        )
+        self.max_concurrency = max_concurrency
+        self.tool_timeout = tool_timeout
+        self.tool_timeouts = tool_timeouts or {}
+
+    def _get_timeout(self, call: ToolCall) -> Optional[float]:
+        return self.tool_timeouts.get(call["name"], self.tool_timeout)
+
+    def _timeout_message(self, call: ToolCall) -> ToolMessage:
+        content = TOOL_TIMEOUT_ERROR_TEMPLATE.format(
+            tool=call["name"], timeout=self._get_timeout(call)
+        )
+        return ToolMessage(content, name=call["name"], tool_call_id=call["id"])
+
+    def _func(self, input: Any, config: RunnableConfig) -> Any:
+        tool_calls, output_type = self._parse_input(input)
+        config_list = get_config_list(config, len(tool_calls))
+        dispatch = _has_parent_run(config)
+        outputs: Dict[int, ToolMessage] = {}
+        started: Dict[int, float] = {}
+
+        def run(position: int, call: ToolCall) -> ToolMessage:
+            started[position] = time.monotonic()
+            return self._run_one(call, config_list[position])
+
+        def finish(position: int, message: ToolMessage) -> None:
+            outputs[position] = message
+            if dispatch:
+                dispatch_custom_event(TOOL_RESULT_EVENT, message, config=config)
+
+        # Threads cannot be interrupted, with timeouts check them periodically
+        has_timeouts = any(self._get_timeout(call) is not None for call in tool_calls)
+        # Calls run in a copy of this context, e.g. with the current user
+        # and the callbacks of the run
+        executor = ContextThreadPoolExecutor(max_workers=self.max_concurrency)
+        futures = {
+            executor.submit(run, position, call): position
+            for position, call in enumerate(tool_calls)
+        }
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(
+                    pending,
+                    timeout=0.05 if has_timeouts else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    finish(futures[future], future.result())
+
+                now = time.monotonic()
+                for future in list(pending):
+                    position = futures[future]
+                    timeout = self._get_timeout(tool_calls[position])
+                    if (
+                        timeout is not None
+                        and position in started
+                        and now - started[position] >= timeout
+                    ):
+                        pending.discard(future)
+                        finish(position, self._timeout_message(tool_calls[position]))
+        finally:
+            executor.shutdown(wait=False)
+
+        messages = [outputs[position] for position in range(len(tool_calls))]
+        return messages if output_type == "list" else {"messages": messages}
+
+    async def _afunc(self, input: Any, config: RunnableConfig) -> Any:
+        tool_calls, output_type = self._parse_input(input)
+        config_list = get_config_list(config, len(tool_calls))
+        dispatch = _has_parent_run(config)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(call: ToolCall, call_config: RunnableConfig) -> ToolMessage:
+            async with semaphore:
+                try:
+                    message = await asyncio.wait_for(
+                        self._arun_one(call, call_config), self._get_timeout(call)
+                    )
+                except asyncio.TimeoutError:
+                    message = self._timeout_message(call)
+            if dispatch:
+                await adispatch_custom_event(TOOL_RESULT_EVENT, message, config=config)
+            return message
+
+        # A turn takes as long as its slowest call, not the sum of them
+        messages = await asyncio.gather(
+            *(run(call, call_config) for call, call_config in zip(tool_calls, config_list))
+        )
+        return messages if output_type == "list" else {"messages": messages}
+
+
 def create_api_controller_agent(
     model: LanguageModelLike,
     tools: Sequence[BaseTool],
@@ -91,6 +233,9 @@ def create_api_controller_agent(
     interrupt_before: Optional[Sequence[str]] = None,
     interrupt_after: Optional[Sequence[str]] = None,
     debug: bool = False,
+    max_concurrency: int = 4,
+    tool_timeout: Optional[float] = None,
+    tool_timeouts: Optional[Dict[str, float]] = None,
 ) -> CompiledGraph:
     """Creates a graph that works with a chat model that utilizes tool calling.
 
@@ -129,6 +274,11 @@ def create_api_controller_agent(
             Should be one of the following: "agent", "tools".
             This is useful if you want to return directly or run additional processing on an output.
         debug: A flag indicating whether to enable debug mode.
+        max_concurrency: The maximum number of tool calls of one AIMessage
+            running at the same time.
+        tool_timeout: Seconds after which a tool call is answered with a
+            timeout error. No timeout by default.
+        tool_timeouts: Timeouts overriding `tool_timeout`, by tool name.
 
     Returns:
         A compiled LangChain runnable that can be used for chat interactions.
@@ -419,7 +569,15 @@ def create_api_controller_agent(
 
     # Define the two nodes we will cycle between
     workflow.add_node("agent", RunnableLambda(call_model, acall_model))
-    workflow.add_node("tools", ToolNode(tools))
+    workflow.add_node(
+        "tools",
+        ConcurrentToolNode(
+            tools,
+            max_concurrency=max_concurrency,
+            tool_timeout=tool_timeout,
+            tool_timeouts=tool_timeouts,
+        ),
+    )
 
     # Set the entrypoint as `agent`
     # This means that this node is the first one called
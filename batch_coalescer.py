@@ -0,0 +1,209 @@
+import asyncio
+import json
+import re
+import httpx
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Mapping, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+if TYPE_CHECKING:
+    from prepare import EndpointIndex
+
+Send = Callable[..., Awaitable[httpx.Response]]
+
+_MAX_IDS_PATTERN = re.compile(r"Maximum: (\d+)|maximum of (\d+)")
+_DEFAULT_MAX_IDS = 20
+
+
+@dataclass
+class BatchRoute:
+    """How single-ID requests to an endpoint are merged into one request.
+
+    `key` is the field of the batch response holding the items, e.g. "tracks"
+    for `GET /tracks`. Endpoints like `GET /me/tracks/contains` already take
+    `ids` and answer with a plain list, their `key` is None.
+    """
+
+    name: str
+    max_ids: int
+    key: Optional[str] = None
+
+
+@dataclass
+class _Batch:
+    url: str
+    params: Dict[str, str]
+    headers: Dict[str, str]
+    route: BatchRoute
+    ids: List[str] = field(default_factory=list)
+    # (url of the caller, slice of `ids` it asked for, future of its response)
+    waiters: List[Tuple[str, slice, asyncio.Future]] = field(default_factory=list)
+    full: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+def _max_ids(docs: dict) -> int:
+    for parameter in docs.get("parameters", ()):
+        if parameter.get("name") == "ids":
+            description = parameter.get("schema", {}).get("description", "")
+            description += parameter.get("description", "")
+            match = _MAX_IDS_PATTERN.search(description)
+            if match:
+                return int(match.group(1) or match.group(2))
+    return _DEFAULT_MAX_IDS
+
+
+def _batch_key(schema: dict) -> Optional[str]:
+    properties = list(schema.get("properties", {}))
+    return properties[0] if len(properties) == 1 else None
+
+
+def _same_items(batch_schema: dict, key: str, item_schema: dict) -> bool:
+    """Whether the batch answers with the objects the single-ID GET returns.
+
+    `GET /shows?ids=` returns simplified shows, without the `episodes` of
+    `GET /shows/{id}`, so its single-ID requests are left alone.
+    """
+    items = batch_schema["properties"][key].get("items")
+    return bool(items) and items == item_schema
+
+
+def _json_response(status_code: int, data: Any, url: str) -> httpx.Response:
+    return httpx.Response(
+        status_code,
+        headers={"content-type": "application/json"},
+        content=json.dumps(data).encode(),
+        request=httpx.Request("GET", url),
+    )
+
+
+class BatchCoalescer:
+    """Merges concurrent single-ID GETs into the spec's batch endpoints.
+
+    `GET /tracks/{id}` requests made within `window` seconds of each other
+    (with the same query parameters and headers) are sent as one
+    `GET /tracks?ids=...`, up to the batch endpoint's maximum number of IDs,
+    and each caller gets back its own item. `GET .../contains?ids=...`
+    requests are merged the same way. Batch endpoints are found in the spec:
+    a GET endpoint taking an `ids` query parameter, plus its `/{id}` variant
+    when the batch items have the same schema as the `/{id}` response.
+    """
+
+    def __init__(self, endpoint_index: "EndpointIndex", window: float = 0.01):
+        self.endpoint_index = endpoint_index
+        self.window = window
+        self.requests = 0
+        self.batches = 0
+
+        self._routes: Dict[str, BatchRoute] = {}
+        self._pending: Dict[tuple, _Batch] = {}
+        # The event loop only keeps weak references to tasks
+        self._flushes: Set[asyncio.Task] = set()
+
+        endpoints = endpoint_index.api_spec.endpoints
+        names = set(getattr(endpoints, "names", None) or [name for name, _, _ in endpoints])
+        for name in names:
+            if not name.startswith("GET "):
+                continue
+            docs = endpoint_index.raw_docs(name)
+            if not any(p.get("name") == "ids" for p in docs.get("parameters", ())):
+                continue
+            schema = endpoint_index.response_schema(name)
+            key = _batch_key(schema)
+            item_name = f"{name}/{{id}}"
+            if (
+                key is not None
+                and item_name in names
+                and _same_items(schema, key, endpoint_index.response_schema(item_name))
+            ):
+                self._routes[item_name] = BatchRoute(name, _max_ids(docs), key)
+            elif key is None:
+                self._routes[name] = BatchRoute(name, _max_ids(docs))
+
+    def route(self, url: str) -> Optional[BatchRoute]:
+        name = self.endpoint_index.find_url("GET", url)
+        return None if name is None else self._routes.get(name)
+
+    async def get(
+        self,
+        send: Send,
+        url: str,
+        params: Optional[Mapping[str, Any]],
+        headers: Dict[str, str],
+    ) -> httpx.Response:
+        """GET a URL that `route` matched, possibly as part of a batch."""
+        route = self.route(url)
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        query.update({str(name): str(value) for name, value in (params or {}).items()})
+
+        if route.key is None:
+            ids = query.pop("ids", "").split(",")
+            batch_url = urlunsplit(parts._replace(query=""))
+        else:
+            path, _, item_id = parts.path.rstrip("/").rpartition("/")
+            ids = [item_id]
+            batch_url = urlunsplit(parts._replace(path=path, query=""))
+        if len(ids) > route.max_ids:
+            return await send("GET", url, params=params)
+
+        self.requests += 1
+        group = (batch_url, tuple(sorted(query.items())), tuple(sorted(headers.items())))
+        batch = self._pending.get(group)
+        if batch is None or len(batch.ids) + len(ids) > route.max_ids:
+            if batch is not None:
+                batch.full.set()
+            batch = self._pending[group] = _Batch(batch_url, query, headers, route)
+            task = asyncio.create_task(self._flush(group, batch, send))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.append((url, slice(len(batch.ids), len(batch.ids) + len(ids)), future))
+        batch.ids.extend(ids)
+        if len(batch.ids) >= route.max_ids:
+            batch.full.set()
+        return await future
+
+    async def _flush(self, group: tuple, batch: _Batch, send: Send) -> None:
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._pending.get(group) is batch:
+            del self._pending[group]
+
+        try:
+            self.batches += 1
+            response = await send(
+                "GET",
+                batch.url,
+                headers=batch.headers,
+                params={**batch.params, "ids": ",".join(batch.ids)},
+            )
+            if response.status_code != 200:
+                results = [response] * len(batch.waiters)
+            else:
+                data = response.json()
+                items = data if batch.route.key is None else data.get(batch.route.key, [])
+                results = [
+                    self._split(items, ids, url, batch.route)
+                    for url, ids, _ in batch.waiters
+                ]
+        except Exception as e:
+            for _, _, future in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(batch.waiters, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _split(self, items: List[Any], ids: slice, url: str, route: BatchRoute) -> httpx.Response:
+        if route.key is None:
+            return _json_response(200, items[ids], url)
+        item = items[ids.start] if ids.start < len(items) else None
+        if item is None:
+            return _json_response(404, {"error": {"status": 404, "message": "Not found."}}, url)
+        return _json_response(200, item, url)
@@ -0,0 +1,75 @@
+"""Benchmark of LLMCompilerPlanParser on long plans streamed token by token.
+
+Run it with `python bench_output_parser.py`. Plans of thousands of tasks are
+cut into tokens of 1 to 5 characters, like a planner streams them, and the
+time to parse every task is reported per task.
+"""
+import random
+import time
+
+from typing import List, Optional
+
+from langchain_core.tools import StructuredTool
+
+from output_parser import LLMCompilerPlanParser
+
+_ACTIONS = [
+    'search("Barack Obama age")',
+    'math("age of Barack Obama in years", context=["$1"])',
+    'math(problem="what is the 110% of $2", context=["$1", "${2}"])',
+    'search(query="Play It Again, Sam (1972) = cast, \'Woody Allen\'")',
+    "math(problem=what's $3 + $4, context=[\"$3\", \"$4\"])",
+]
+
+
+def _math(problem: str, context: Optional[List[str]] = None) -> str:
+    """Solve a math problem."""
+    return problem
+
+
+def _search(query: str) -> str:
+    """Search the web."""
+    return query
+
+
+TOOLS = [
+    StructuredTool.from_function(_math, name="math"),
+    StructuredTool.from_function(_search, name="search"),
+]
+
+
+def plan_tokens(tasks: int, seed: int = 0) -> List[str]:
+    """A plan of `tasks` actions, each after a thought, cut into small tokens."""
+    plan = "".join(
+        f"Thought: step {i}\n{i}. {_ACTIONS[i % len(_ACTIONS)]}\n" for i in range(1, tasks + 1)
+    )
+    rng = random.Random(seed)
+    tokens = []
+    position = 0
+    while position < len(plan):
+        size = rng.randint(1, 5)
+        tokens.append(plan[position : position + size])
+        position += size
+    return tokens + ["<END_OF_PLAN>"]
+
+
+def benchmark(tasks: int, repeat: int = 3) -> float:
+    """Best time to parse a streamed plan of `tasks` actions, in seconds."""
+    tokens = plan_tokens(tasks)
+    best = float("inf")
+    for _ in range(repeat):
+        parser = LLMCompilerPlanParser(tools=TOOLS)
+        start = time.perf_counter()
+        parsed = sum(1 for _ in parser._transform(iter(tokens)))
+        best = min(best, time.perf_counter() - start)
+        assert parsed == tasks, parsed
+    return best
+
+
+if __name__ == "__main__":
+    for tasks in (1000, 3000, 10000):
+        elapsed = benchmark(tasks)
+        print(
+            f"{tasks} tasks: {elapsed * 1000:.0f} ms,",
+            f"{elapsed / tasks * 1e6:.1f} us per task",
+        )
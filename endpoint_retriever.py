@@ -0,0 +1,199 @@
+import math
+import os
+import pickle
+import re
+import tempfile
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_community.agent_toolkits.openapi.spec import ReducedOpenAPISpec
+
+from spec_loader import CACHE_DIR
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = frozenset(
+    "a an and are as at be by for from get i in is it me my of on or the this to "
+    "with you your".split()
+)
+# Words users say for an operation, the spec rarely uses them
+_METHOD_WORDS = {
+    "GET": "get list show find check",
+    "POST": "add create",
+    "PUT": "save set change update start",
+    "PATCH": "change update",
+    "DELETE": "remove delete unfollow",
+}
+_SYNONYMS = {"song": "track", "tune": "track", "band": "artist", "singer": "artist", "record": "album"}
+
+
+def _tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token in _STOP_WORDS:
+            continue
+        # Naive plural stemming: playlists -> playlist, tracks -> track
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        # playing -> play, following -> follow
+        if len(token) > 6 and token.endswith("ing"):
+            token = token[:-3]
+        tokens.append(_SYNONYMS.get(token, token))
+    return tokens
+
+
+def _endpoint_tokens(name: str, description: Optional[str]) -> List[str]:
+    method, route = name.split(" ", 1)
+    route_tokens = _tokenize(re.sub(r"\{.*?\}", " ", route.replace("-", " ")))
+    # Path words are the strongest signal, count them twice
+    return (
+        route_tokens * 2
+        + _tokenize(_METHOD_WORDS.get(method, ""))
+        + _tokenize(description or "")
+    )
+
+
+class EndpointRetriever:
+    """Okapi BM25 index over the names and descriptions of spec endpoints.
+
+    The index is built once per spec, stored in `cache_dir` next to the spec
+    cache and only read from disk on the first search.
+    """
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, api_spec: ReducedOpenAPISpec, spec_hash: str, cache_dir: str = CACHE_DIR):
+        self.api_spec = api_spec
+        self.path = os.path.join(cache_dir, f"endpoints.{spec_hash[:16]}.bm25")
+        self._index: Optional[dict] = None
+
+    def build(self) -> dict:
+        names: List[str] = []
+        descriptions: List[str] = []
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths: List[int] = []
+        for position, (name, description, _) in enumerate(self.api_spec.endpoints):
+            tokens = _endpoint_tokens(name, description)
+            names.append(name)
+            descriptions.append(description or "")
+            lengths.append(len(tokens))
+            for token, frequency in Counter(tokens).items():
+                postings.setdefault(token, []).append((position, frequency))
+
+        count = len(names)
+        return {
+            "names": names,
+            "descriptions": descriptions,
+            "postings": postings,
+            "idf": {
+                token: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+                for token, docs in postings.items()
+            },
+            "lengths": lengths,
+            "average_length": sum(lengths) / max(count, 1),
+        }
+
+    def _load(self) -> dict:
+        if self._index is not None:
+            return self._index
+        try:
+            with open(self.path, "rb") as file:
+                self._index = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self._index = self.build()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump(self._index, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._remove_stale_indexes()
+        return self._index
+
+    def _remove_stale_indexes(self) -> None:
+        cache_dir = os.path.dirname(self.path)
+        for file_name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, file_name)
+            if file_name.startswith("endpoints.") and file_name.endswith(".bm25") and path != self.path:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def search(self, query: str, k: int) -> List[str]:
+        """Return the names of the `k` endpoints most relevant to the query."""
+        index = self._load()
+        scores: Dict[int, float] = {}
+        for token in set(_tokenize(query)):
+            idf = index["idf"].get(token)
+            if idf is None:
+                continue
+            for position, frequency in index["postings"][token]:
+                length_norm = 1 - self.b + self.b * index["lengths"][position] / index["average_length"]
+                scores[position] = scores.get(position, 0.0) + idf * (
+                    frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                )
+        ranked = sorted(scores, key=lambda position: (-scores[position], position))
+        return [index["names"][position] for position in ranked[:k]]
+
+    def describe(
+        self, query: str, k: int, always_include: Sequence[str] = ()
+    ) -> List[str]:
+        """Return `"{name} {description}"` lines for the planner prompt."""
+        index = self._load()
+        descriptions = dict(zip(index["names"], index["descriptions"]))
+        names = list(always_include)
+        names.extend(name for name in self.search(query, k) if name not in names)
+        return [f"{name} {descriptions[name]}" for name in names if name in descriptions]
+
+
+# Fixed query set for tuning k: query -> endpoints a good plan needs
+RECALL_QUERIES: List[Tuple[str, List[str]]] = [
+    ("play my Discover Weekly", ["GET /me/playlists", "PUT /me/player/play"]),
+    ("add this song to my road trip playlist", ["GET /me/playlists", "POST /playlists/{playlist_id}/tracks"]),
+    ("make me a playlist called machine blues", ["GET /me", "POST /users/{user_id}/playlists"]),
+    ("what song is playing right now", ["GET /me/player/currently-playing"]),
+    ("skip to the next song", ["POST /me/player/next"]),
+    ("pause the music", ["PUT /me/player/pause"]),
+    ("turn the volume down to 30", ["PUT /me/player/volume"]),
+    ("shuffle my music", ["PUT /me/player/shuffle"]),
+    ("who are my top artists", ["GET /me/top/{type}"]),
+    ("show my saved albums", ["GET /me/albums"]),
+    ("save this album to my library", ["PUT /me/albums"]),
+    ("remove the first track from my workout playlist", ["GET /me/playlists", "DELETE /playlists/{playlist_id}/tracks"]),
+    ("find songs by Miles Davis", ["GET /search"]),
+    ("what are the tracks on kind of blue", ["GET /search", "GET /albums/{id}/tracks"]),
+    ("follow Radiohead", ["GET /search", "PUT /me/following"]),
+    ("recommend songs similar to my recently played", ["GET /me/player/recently-played", "GET /recommendations"]),
+    ("queue bohemian rhapsody", ["GET /search", "POST /me/player/queue"]),
+    ("list the tracks in my chill playlist", ["GET /me/playlists", "GET /playlists/{playlist_id}/tracks"]),
+    ("which devices can I play on", ["GET /me/player/devices"]),
+    ("rename my party playlist", ["GET /me/playlists", "PUT /playlists/{playlist_id}"]),
+]
+
+
+def recall_at_k(
+    retriever: EndpointRetriever,
+    k: int,
+    queries: Iterable[Tuple[str, List[str]]] = RECALL_QUERIES,
+    always_include: Sequence[str] = (),
+) -> float:
+    """Share of the expected endpoints found in the top `k` results."""
+    found = expected = 0
+    for query, endpoints in queries:
+        results = set(always_include).union(retriever.search(query, k))
+        found += sum(endpoint in results for endpoint in endpoints)
+        expected += len(endpoints)
+    return found / max(expected, 1)
+
+
+if __name__ == "__main__":
+    from spec_loader import load_spec
+
+    spotify_spec = load_spec("spotify_openapi.yaml")
+    retriever = EndpointRetriever(spotify_spec.api_spec, spotify_spec.spec_hash)
+    for k in (5, 10, 15, 20, 30):
+        print(
+            f"recall@{k}: {recall_at_k(retriever, k):.2f}",
+            f"(with /me and /search: {recall_at_k(retriever, k, always_include=('GET /me', 'GET /search')):.2f})",
+        )
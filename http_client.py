@@ -0,0 +1,329 @@
+import asyncio
+import importlib.util
+import threading
+import weakref
+import httpx
+
+from typing import Any, Callable, Dict, Optional, Union
+from urllib.parse import urlsplit
+
+from langchain_community.utilities.requests import TextRequestsWrapper
+from langchain_core.pydantic_v1 import PrivateAttr
+
+from batch_coalescer import BatchCoalescer
+from paginator import Paginator
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+
+
+class ConnectionPool:
+    """Pooled httpx clients shared by every copy of an `AsyncRequestsWrapper`.
+
+    httpx.AsyncClient is bound to the event loop it was first used on, so one
+    client (and one set of per-host semaphores) is kept per running loop.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive_connections: int,
+        max_connections_per_host: int,
+        http2: bool,
+        timeout: float,
+        verify: bool,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.max_connections_per_host = max_connections_per_host
+        # HTTP/2 needs the optional h2 package
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.timeout = timeout
+        self.verify = verify
+
+        self._lock = threading.Lock()
+        self._sync_client: Optional[httpx.Client] = None
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._host_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(
+                    http2=self.http2,
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    verify=self.verify,
+                )
+            return self._sync_client
+
+    def async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+                verify=self.verify,
+            )
+        return client
+
+    def host_limit(self, url: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        host_limits = self._host_limits.setdefault(loop, {})
+        host = urlsplit(url).netloc
+        semaphore = host_limits.get(host)
+        if semaphore is None:
+            semaphore = host_limits[host] = asyncio.Semaphore(
+                self.max_connections_per_host
+            )
+        return semaphore
+
+    async def aclose(self) -> None:
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+
+class AsyncRequestsWrapper(TextRequestsWrapper):
+    """Drop-in for `RequestsWrapper` backed by pooled keep-alive httpx clients.
+
+    Async calls share one client per event loop and at most
+    `max_connections_per_host` requests are in flight per host. GET responses
+    go through `cache` when one is given. `header_provider` is called for
+    every request, e.g. to add the current user's Authorization header.
+    With a `rate_limiter`, requests wait for their budget and 429 responses
+    are retried after their `Retry-After` delay instead of being returned.
+    Concurrent async single-ID GETs are merged into batch requests by
+    `coalescer`, and async GETs of list endpoints return every page, up to a
+    cap, through `paginator`, which answers requests for later pages of those
+    lists from its buffer.
+    """
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    max_connections_per_host: int = 10
+    http2: bool = True
+    timeout: float = 30.0
+    cache: Optional[ResponseCache] = None
+    header_provider: Optional[Callable[[], Dict[str, str]]] = None
+    rate_limiter: Optional[RateLimiter] = None
+    coalescer: Optional[BatchCoalescer] = None
+    paginator: Optional[Paginator] = None
+
+    _pool: ConnectionPool = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        # Tools copy the wrapper on validation, the pool object is shared
+        self._pool = ConnectionPool(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            max_connections_per_host=self.max_connections_per_host,
+            http2=self.http2,
+            timeout=self.timeout,
+            verify=self.verify,
+        )
+
+    def _get_resp_content(self, response: httpx.Response) -> Union[str, Dict[str, Any]]:
+        if self.response_content_type == "text":
+            return response.text
+        elif self.response_content_type == "json":
+            return response.json()
+        else:
+            raise ValueError(f"Invalid return type: {self.response_content_type}")
+
+    def _request_headers(self) -> Dict[str, str]:
+        headers = dict(self.headers or {})
+        if self.header_provider is not None:
+            headers.update(self.header_provider())
+        return headers
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        retries = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(method, url)
+            response = self._pool.sync_client().request(
+                method,
+                url,
+                headers={**self._request_headers(), **(headers or {})},
+                auth=self.auth,
+                **kwargs,
+            )
+            if (
+                response.status_code != 429
+                or self.rate_limiter is None
+                or retries >= self.rate_limiter.max_retries
+            ):
+                return response
+            self.rate_limiter.throttle(response.headers.get("Retry-After"))
+            retries += 1
+
+    async def _asend(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        retries = 0
+        while True:
+            # Wait for the budget before taking a connection slot
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(method, url)
+            async with self._pool.host_limit(url):
+                response = await self._pool.async_client().request(
+                    method,
+                    url,
+                    headers={**self._request_headers(), **(headers or {})},
+                    auth=self.auth,
+                    **kwargs,
+                )
+            if (
+                response.status_code != 429
+                or self.rate_limiter is None
+                or retries >= self.rate_limiter.max_retries
+            ):
+                return response
+            self.rate_limiter.throttle(response.headers.get("Retry-After"))
+            retries += 1
+
+    async def _aget(
+        self, url: str, headers: Optional[Dict[str, str]] = None, **kwargs: Any
+    ) -> httpx.Response:
+        # Revalidations stay single requests, a batch has no ETag per item
+        if self.coalescer is not None and not headers and self.coalescer.route(url):
+            return await self.coalescer.get(
+                self._asend, url, kwargs.get("params"), self._request_headers()
+            )
+        if self.paginator is not None and not headers:
+            params = kwargs.get("params")
+            request_headers = self._request_headers()
+            # Later pages of a list that was fetched whole come from its buffer
+            buffered = self.paginator.buffered(url, params, request_headers)
+            if buffered is not None:
+                return buffered
+            if self.paginator.route(url, params):
+                return await self.paginator.get(self._asend, url, params, request_headers)
+        return await self._asend("GET", url, headers=headers, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        if self.cache is None:
+            return self._send(method, url, **kwargs)
+        if method != "GET":
+            response = self._send(method, url, **kwargs)
+            if response.is_success:
+                self.cache.invalidate(url)
+            return response
+
+        key = self.cache.key(url, kwargs.get("params"), self._request_headers())
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return self.cache.hit(entry)
+        response = self._send(
+            method, url, headers=self.cache.revalidation_headers(entry), **kwargs
+        )
+        return self.cache.update(key, entry, response)
+
+    async def arequest(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        if self.cache is None:
+            if method == "GET":
+                return await self._aget(url, **kwargs)
+            return await self._asend(method, url, **kwargs)
+        if method != "GET":
+            response = await self._asend(method, url, **kwargs)
+            if response.is_success:
+                self.cache.invalidate(url)
+            return response
+
+        key = self.cache.key(url, kwargs.get("params"), self._request_headers())
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return self.cache.hit(entry)
+        response = await self._aget(
+            url, headers=self.cache.revalidation_headers(entry), **kwargs
+        )
+        return self.cache.update(key, entry, response)
+
+    def get(self, url: str, **kwargs: Any) -> Union[str, Dict[str, Any]]:
+        """GET the URL and return the text."""
+        return self._get_resp_content(self.request("GET", url, **kwargs))
+
+    def post(
+        self, url: str, data: Dict[str, Any], **kwargs: Any
+    ) -> Union[str, Dict[str, Any]]:
+        """POST to the URL and return the text."""
+        return self._get_resp_content(self.request("POST", url, json=data, **kwargs))
+
+    def patch(
+        self, url: str, data: Dict[str, Any], **kwargs: Any
+    ) -> Union[str, Dict[str, Any]]:
+        """PATCH the URL and return the text."""
+        return self._get_resp_content(self.request("PATCH", url, json=data, **kwargs))
+
+    def put(
+        self, url: str, data: Dict[str, Any], **kwargs: Any
+    ) -> Union[str, Dict[str, Any]]:
+        """PUT the URL and return the text."""
+        return self._get_resp_content(self.request("PUT", url, json=data, **kwargs))
+
+    def delete(self, url: str, **kwargs: Any) -> Union[str, Dict[str, Any]]:
+        """DELETE the URL and return the text."""
+        return self._get_resp_content(self.request("DELETE", url, **kwargs))
+
+    async def aget(self, url: str, **kwargs: Any) -> Union[str, Dict[str, Any]]:
+        """GET the URL and return the text asynchronously."""
+        return self._get_resp_content(await self.arequest("GET", url, **kwargs))
+
+    async def apost(
+        self, url: str, data: Dict[str, Any], **kwargs: Any
+    ) -> Union[str, Dict[str, Any]]:
+        """POST to the URL and return the text asynchronously."""
+        return self._get_resp_content(
+            await self.arequest("POST", url, json=data, **kwargs)
+        )
+
+    async def apatch(
+        self, url: str, data: Dict[str, Any], **kwargs: Any
+    ) -> Union[str, Dict[str, Any]]:
+        """PATCH the URL and return the text asynchronously."""
+        return self._get_resp_content(
+            await self.arequest("PATCH", url, json=data, **kwargs)
+        )
+
+    async def aput(
+        self, url: str, data: Dict[str, Any], **kwargs: Any
+    ) -> Union[str, Dict[str, Any]]:
+        """PUT the URL and return the text asynchronously."""
+        return self._get_resp_content(
+            await self.arequest("PUT", url, json=data, **kwargs)
+        )
+
+    async def adelete(self, url: str, **kwargs: Any) -> Union[str, Dict[str, Any]]:
+        """DELETE the URL and return the text asynchronously."""
+        return self._get_resp_content(await self.arequest("DELETE", url, **kwargs))
+
+    async def aclose(self) -> None:
+        await self._pool.aclose()
+
+    def close(self) -> None:
+        self._pool.close()
@@ -1,16 +1,26 @@
 import math
 import re
-from typing import List, Optional
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Sequence, Tuple, Union
 
 import numexpr
+import numpy as np
+from numexpr.necompiler import evaluate_lock
 from langchain.chains.openai_functions import create_structured_output_runnable
+from langchain_core.callbacks import CallbackManager
 from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.pydantic_v1 import BaseModel, Field, ValidationError
 from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import get_config_list, patch_config, run_in_executor
 from langchain_core.tools import StructuredTool
+from langchain_core.tools.base import _handle_validation_error
 from langchain_openai import ChatOpenAI
 
+from observation_store import to_content
+
 _MATH_DESCRIPTION = (
     "math(problem: str, context: Optional[list[str]]) -> float:\n"
     " - Solves the provided math problem.\n"
@@ -86,15 +96,22 @@ class ExecuteCode(BaseModel):
     )
 
 
-def _evaluate_expression(expression: str) -> str:
+# A math result: a Python int, float or bool for a scalar, else the array
+MathResult = Union[int, float, bool, complex, np.ndarray]
+
+
+def _to_result(value: np.ndarray) -> MathResult:
+    # Arrays are returned as numexpr made them, without a copy
+    return value.item() if value.ndim == 0 else value
+
+
+def _evaluate_expression(expression: str) -> MathResult:
     try:
         local_dict = {"pi": math.pi, "e": math.e}
-        output = str(
-            numexpr.evaluate(
-                expression.strip(),
-                global_dict={},  # restrict access to globals
-                local_dict=local_dict,  # add common mathematical functions
-            )
+        output = numexpr.evaluate(
+            expression.strip(),
+            global_dict={},  # restrict access to globals
+            local_dict=local_dict,  # add common mathematical functions
         )
     except Exception as e:
         raise ValueError(
@@ -102,11 +119,268 @@ def _evaluate_expression(expression: str) -> str:
             " Please try again with a valid numerical expression"
         )
 
-    # Remove any leading and trailing brackets from the output
-    return re.sub(r"^\[|\]$", "", output)
+    return _to_result(output)
+
+
+# Names numexpr knows, a problem using no other word is a plain expression
+_NUMEXPR_NAMES = frozenset(
+    {
+        "pi", "e", "sqrt", "abs", "exp", "expm1", "log", "log10", "log1p",
+        "sin", "cos", "tan", "arcsin", "arccos", "arctan", "arctan2",
+        "sinh", "cosh", "tanh", "arcsinh", "arccosh", "arctanh",
+        "floor", "ceil", "where",
+    }
+)
+_NAME_PATTERN = re.compile(r"\b[A-Za-z_]\w*")
+# What is left of an expression once its names are removed, "e" is an exponent
+_EXPRESSION_PATTERN = re.compile(r"[\d\s.eE+\-*/%(),<>=!]*\d[\d\s.eE+\-*/%(),<>=!]*")
+_QUESTION_PATTERN = re.compile(
+    r"^\s*(?:what\s+is|what's|calculate|compute|evaluate)\s+|[\s?=]+$", re.IGNORECASE
+)
+_THOUSANDS_PATTERN = re.compile(r"(?<=\d),(?=\d{3}\b)")
+
+
+def _as_expression(problem: str) -> Optional[str]:
+    """Return the problem as a numexpr expression if it already is one.
+
+    "What is 37593 * 67?" and "2,518,731 ^ 2" are expressions, "37593 times
+    67" or anything naming a quantity is a word problem for the LLM.
+    """
+    expression = _QUESTION_PATTERN.sub("", problem)
+    expression = _THOUSANDS_PATTERN.sub("", expression).replace("^", "**")
+    if not set(_NAME_PATTERN.findall(expression)) <= _NUMEXPR_NAMES:
+        return None
+    if not _EXPRESSION_PATTERN.fullmatch(_NAME_PATTERN.sub("", expression)):
+        return None
+    return expression
+
+
+_LITERAL_PATTERN = re.compile(r"(?<![\w.])(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_CONSTANT_PATTERNS = (
+    (re.compile(r"\bpi\b"), repr(math.pi)),
+    (re.compile(r"\be\b"), repr(math.e)),
+)
+
+
+def _structure(expression: str) -> Tuple[str, Tuple[bool, ...], List[str]]:
+    """Split an expression into a template over its numbers and the numbers.
+
+    "37593 * 67" and "12 * 4" share the template "_0 * _1". The flags tell
+    which numbers are integers, so a batch keeps the types scalars would get.
+    """
+    literals: List[str] = []
+
+    def placeholder(match: re.Match) -> str:
+        literals.append(match.group(0))
+        return f"_{len(literals) - 1}"
+
+    template = _LITERAL_PATTERN.sub(placeholder, expression.strip())
+    for pattern, value in _CONSTANT_PATTERNS:
+        template = pattern.sub(value, template)
+    kinds = tuple(literal.isdigit() for literal in literals)
+    return template, kinds, literals
+
+
+# True division and negative powers give floats even between integers
+_FLOAT_PATTERN = re.compile(r"(?<!/)/(?!/)|\*\*\s*\(?\s*-")
+# Largest integer a float64 holds exactly, and the first one an int64 does not
+_EXACT_INT = 2**53
+_INT64_LIMIT = 2.0**63
+
+
+@lru_cache(maxsize=256)
+def _compile(template: str, kinds: Tuple[bool, ...]) -> numexpr.NumExpr:
+    return numexpr.NumExpr(
+        template,
+        signature=[
+            (f"_{i}", np.int64 if is_int else np.float64) for i, is_int in enumerate(kinds)
+        ],
+    )
+
+
+def _evaluate_group(
+    template: str, kinds: Tuple[bool, ...], members: List[Tuple[int, List[str]]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Evaluate expressions sharing a template, and tell which came out right.
+
+    `numexpr.evaluate` folds literals with Python's arithmetic: 2 ** -1 is
+    0.5, and 10 ** 20 or 1 / 0 raise where int64 arrays would give 0, wrap
+    around or give inf. Templates dividing or raising to a negative power
+    run in float64, integer results must match a float64 evaluation within
+    the int64 range, and float results must be finite.
+    """
+    valid = np.ones(len(members), dtype=bool)
+    if _FLOAT_PATTERN.search(template):
+        # Python divides exact integers, float64 only holds them up to 2 ** 53
+        valid &= [
+            all(not literal.isdigit() or int(literal) <= _EXACT_INT for literal in literals)
+            for _, literals in members
+        ]
+        kinds = (False,) * len(kinds)
+    columns = [
+        np.array(
+            [int(literals[i]) if is_int else float(literals[i]) for _, literals in members],
+            dtype=np.int64 if is_int else np.float64,
+        )
+        for i, is_int in enumerate(kinds)
+    ]
+    # Shares numexpr's lock with numexpr.evaluate
+    with evaluate_lock:
+        values = np.broadcast_to(_compile(template, kinds)(*columns), (len(members),))
+        if values.dtype.kind in "iu":
+            floats = np.broadcast_to(
+                _compile(template, (False,) * len(kinds))(
+                    *(column.astype(np.float64) for column in columns)
+                ),
+                (len(members),),
+            )
+    if values.dtype.kind in "iu":
+        # Negative powers truncate and overflows wrap around in int64
+        valid &= np.abs(floats) < _INT64_LIMIT
+        valid &= np.isclose(values, floats, rtol=1e-9, atol=0)
+    elif values.dtype.kind in "fc":
+        valid &= np.isfinite(values)
+    return values, valid
+
+
+def evaluate_batch(expressions: Sequence[str]) -> List[Union[MathResult, ValueError]]:
+    """Evaluate many expressions, one numexpr call per expression structure.
+
+    Expressions differing only by their numbers are evaluated together over
+    arrays of those numbers, with the compiled template cached, instead of
+    paying numexpr's parsing and setup once per scalar. Each result is what
+    `_evaluate_expression` would return, or the ValueError it would raise:
+    expressions the arrays get wrong are evaluated one by one.
+    """
+    results: List[Union[MathResult, ValueError, None]] = [None] * len(expressions)
+    groups: Dict[Tuple[str, Tuple[bool, ...]], List[Tuple[int, List[str]]]] = {}
+    for position, expression in enumerate(expressions):
+        template, kinds, literals = _structure(expression)
+        groups.setdefault((template, kinds), []).append((position, literals))
+
+    remaining: List[int] = []
+    for (template, kinds), members in groups.items():
+        if len(members) == 1:
+            remaining.append(members[0][0])
+            continue
+        try:
+            values, valid = _evaluate_group(template, kinds, members)
+        except Exception:
+            remaining.extend(position for position, _ in members)
+            continue
+        for (position, _), value, ok in zip(members, values, valid):
+            if ok:
+                results[position] = value.item()
+            else:
+                remaining.append(position)
+
+    # Single expressions, and those the batch got wrong: report each error
+    for position in remaining:
+        try:
+            results[position] = _evaluate_expression(expressions[position])
+        except ValueError as e:
+            results[position] = e
+    return results
+
+
+class MathTool(StructuredTool):
+    """`math` tool solving a batch of problems at once.
+
+    `batch` evaluates every plain expression with one `evaluate_batch` call
+    and sends the word problems to the LLM concurrently. Each problem is
+    still its own tool run: its input is validated against `args_schema`
+    and the callbacks get its `on_tool_start` and `on_tool_end`. `batched`
+    tells the scheduler to hand it all the ready `math` tasks together.
+    """
+
+    batched: ClassVar[bool] = True
+
+    batch_func: Callable[..., List[Union[MathResult, str]]]
+
+    def batch(
+        self,
+        inputs: List[Any],
+        config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> List[Union[MathResult, str, Exception]]:
+        configs = get_config_list(config, len(inputs))
+        run_managers = [
+            CallbackManager.configure(
+                run_config.get("callbacks"),
+                self.callbacks,
+                self.verbose,
+                run_config.get("tags"),
+                self.tags,
+                run_config.get("metadata"),
+                self.metadata,
+            ).on_tool_start(
+                {"name": self.name, "description": self.description},
+                tool_input if isinstance(tool_input, str) else str(tool_input),
+                name=run_config.get("run_name"),
+                run_id=run_config.pop("run_id", None),
+                inputs=tool_input if isinstance(tool_input, dict) else None,
+            )
+            for tool_input, run_config in zip(inputs, configs)
+        ]
+
+        results: List[Any] = [None] * len(inputs)
+        valid: List[int] = []
+        for position, tool_input in enumerate(inputs):
+            try:
+                results[position] = self._parse_input(tool_input)
+                valid.append(position)
+            except ValidationError as e:
+                results[position] = (
+                    _handle_validation_error(e, flag=self.handle_validation_error)
+                    if self.handle_validation_error
+                    else e
+                )
+        if valid:
+            try:
+                solved = self.batch_func(
+                    [results[position] for position in valid],
+                    [
+                        patch_config(configs[position], callbacks=run_managers[position].get_child())
+                        for position in valid
+                    ],
+                )
+            except Exception as e:
+                solved = [e] * len(valid)
+            for position, result in zip(valid, solved):
+                results[position] = result
 
+        for run_manager, result in zip(run_managers, results):
+            if isinstance(result, Exception):
+                run_manager.on_tool_error(result)
+            else:
+                run_manager.on_tool_end(result, name=self.name)
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
 
-def get_math_tool(llm: ChatOpenAI):
+    async def abatch(
+        self,
+        inputs: List[Any],
+        config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> List[Union[MathResult, str, Exception]]:
+        configs = get_config_list(config, len(inputs))
+        return await run_in_executor(
+            configs[0] if configs else None,
+            self.batch,
+            inputs,
+            configs,
+            return_exceptions=return_exceptions,
+        )
+
+
+def get_math_tool(llm: ChatOpenAI, memo_size: int = 1024):
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system", _SYSTEM_PROMPT),
@@ -115,28 +389,104 @@ def get_math_tool(llm: ChatOpenAI):
         ]
     )
     extractor = create_structured_output_runnable(ExecuteCode, llm, prompt)
+    # (problem, context) -> result of the problems solved so far
+    memo: "OrderedDict[Tuple[str, Tuple[str, ...]], MathResult]" = OrderedDict()
+    memo_lock = threading.Lock()
 
-    def calculate_expression(
-        problem: str,
-        context: Optional[List[str]] = None,
-        config: Optional[RunnableConfig] = None,
-    ):
+    def remember(key: Tuple[str, Tuple[str, ...]], result: MathResult) -> MathResult:
+        with memo_lock:
+            memo[key] = result
+            if len(memo) > memo_size:
+                memo.popitem(last=False)
+        return result
+
+    def chain_input(problem: str, context: Optional[List[Any]]) -> dict:
         chain_input = {"problem": problem}
         if context:
-            context_str = "\n".join(context)
+            context_str = "\n".join(map(to_content, context))
             if context_str.strip():
                 context_str = _ADDITIONAL_CONTEXT_PROMPT.format(
                     context=context_str.strip()
                 )
                 chain_input["context"] = [SystemMessage(content=context_str)]
-        code_model = extractor.invoke(chain_input, config)
-        try:
-            return _evaluate_expression(code_model.code)
-        except Exception as e:
-            return repr(e)
+        return chain_input
+
+    def calculate_batch(
+        problems: Sequence[Union[str, dict]],
+        config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+    ) -> List[Union[MathResult, str]]:
+        # One config per problem, the LLM calls of each run under its own
+        configs = get_config_list(config, len(problems))
+        problems = [
+            {
+                "problem": to_content(problem["problem"]),
+                "context": problem.get("context"),
+            }
+            if isinstance(problem, dict)
+            else {"problem": to_content(problem)}
+            for problem in problems
+        ]
+        keys = [
+            (
+                problem["problem"],
+                tuple(map(to_content, problem.get("context") or ())),
+            )
+            for problem in problems
+        ]
+        results: List[Union[MathResult, str, None]] = [None] * len(problems)
+        with memo_lock:
+            for position, key in enumerate(keys):
+                if key in memo:
+                    memo.move_to_end(key)
+                    results[position] = memo[key]
+
+        # $N arguments are already substituted, plain expressions skip the LLM
+        codes: Dict[int, str] = {}
+        for position, problem in enumerate(problems):
+            if results[position] is None:
+                expression = _as_expression(problem["problem"])
+                if expression is not None:
+                    codes[position] = expression
+        for position, result in zip(codes, evaluate_batch(list(codes.values()))):
+            if not isinstance(result, ValueError):
+                results[position] = remember(keys[position], result)
+
+        word_problems = [position for position, result in enumerate(results) if result is None]
+        if not word_problems:
+            return results
+        code_models = extractor.batch(
+            [
+                chain_input(problems[position]["problem"], problems[position].get("context"))
+                for position in word_problems
+            ],
+            [configs[position] for position in word_problems],
+            return_exceptions=True,
+        )
+        codes = {}
+        for position, code_model in zip(word_problems, code_models):
+            if isinstance(code_model, Exception):
+                results[position] = repr(code_model)
+            else:
+                codes[position] = code_model.code
+        for position, result in zip(codes, evaluate_batch(list(codes.values()))):
+            results[position] = (
+                repr(result)
+                if isinstance(result, ValueError)
+                else remember(keys[position], result)
+            )
+        return results
+
+    def calculate_expression(
+        problem: str,
+        # Results of earlier tasks come as numbers or arrays
+        context: Optional[List[Any]] = None,
+        config: Optional[RunnableConfig] = None,
+    ):
+        return calculate_batch([{"problem": problem, "context": context}], config)[0]
 
-    return StructuredTool.from_function(
+    return MathTool.from_function(
         name="math",
         func=calculate_expression,
         description=_MATH_DESCRIPTION,
+        batch_func=calculate_batch,
     )
@@ -0,0 +1,217 @@
+import os
+import pickle
+import re
+import tempfile
+import threading
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.messages import BaseMessage, FunctionMessage
+
+
+def is_typed(observation: Any) -> bool:
+    """Numbers and arrays, e.g. math results, travel as values between tasks."""
+    return isinstance(observation, (int, float, complex)) or hasattr(observation, "ndim")
+
+
+def to_content(observation: Any) -> str:
+    """Text of an observation, observations only become text for the LLM."""
+    if isinstance(observation, str):
+        return observation
+    if hasattr(observation, "ndim") and observation.ndim:
+        # Arrays without their leading and trailing brackets
+        return re.sub(r"^\[|\]$", "", str(observation))
+    return str(observation)
+
+
+class _Spilled:
+    """An observation written to disk, `preview` is what the LLM gets."""
+
+    __slots__ = ("path", "preview")
+
+    def __init__(self, path: str, preview: str):
+        self.path = path
+        self.preview = preview
+
+
+class ObservationStore(MutableMapping):
+    """Tool results of an LLMCompiler run, by task idx, with bounded memory.
+
+    Results over `spill_size` bytes are written to a temporary directory
+    (under `spill_dir` if given) right away, and the oldest results are
+    spilled once the ones in memory pass `memory_limit` bytes. Reading a
+    spilled result loads it back, arrays as read-only memory maps. The
+    FunctionMessage of a result is built once and kept by idx, its content
+    cut to `max_content_chars` characters, so a replan neither rescans the
+    messages nor re-stringifies every result.
+
+    Keep one store for all the replans of a question: pass it to
+    `schedule_tasks` as `SchedulerInput["store"]`.
+    """
+
+    def __init__(
+        self,
+        max_content_chars: int = 8000,
+        spill_size: int = 64 * 1024,
+        memory_limit: int = 8 * 1024 * 1024,
+        spill_dir: Optional[str] = None,
+    ):
+        self.max_content_chars = max_content_chars
+        self.spill_size = spill_size
+        self.memory_limit = memory_limit
+        self.memory = 0
+        self.spilled = 0
+
+        self._lock = threading.RLock()
+        # idx -> (value or _Spilled, size in memory), oldest first
+        self._entries: "OrderedDict[int, Tuple[Any, int]]" = OrderedDict()
+        self._messages: Dict[int, FunctionMessage] = {}
+        self.spill_dir = spill_dir
+        self._temporary_dir: Optional[tempfile.TemporaryDirectory] = None
+
+    @classmethod
+    def from_messages(cls, messages: List[BaseMessage], **kwargs: Any) -> "ObservationStore":
+        """Store holding the results of the FunctionMessages of a conversation."""
+        store = cls(**kwargs)
+        for message in messages:
+            if isinstance(message, FunctionMessage):
+                idx = int(message.additional_kwargs["idx"])
+                if idx not in store:
+                    # Typed results (e.g. numbers) are kept next to their text
+                    store[idx] = message.additional_kwargs.get("value", message.content)
+                    store._messages[idx] = message
+        return store
+
+    def _directory(self) -> str:
+        if self._temporary_dir is None:
+            if self.spill_dir is not None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self._temporary_dir = tempfile.TemporaryDirectory(
+                prefix="observations-", dir=self.spill_dir
+            )
+        return self._temporary_dir.name
+
+    def _preview(self, content: str) -> str:
+        if len(content) <= self.max_content_chars:
+            return content
+        return (
+            content[: self.max_content_chars]
+            + f"\n...({len(content) - self.max_content_chars} more characters)"
+        )
+
+    def _spill(self, idx: int, value: Any, content: Optional[str] = None) -> _Spilled:
+        if content is None:
+            content = to_content(value)
+        if isinstance(value, np.ndarray):
+            path = os.path.join(self._directory(), f"{idx}.npy")
+            np.save(path, value)
+        else:
+            path = os.path.join(self._directory(), f"{idx}.pickle")
+            with open(path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spilled += 1
+        return _Spilled(path, self._preview(content))
+
+    def _load(self, spilled: _Spilled) -> Any:
+        if spilled.path.endswith(".npy"):
+            # Views of the file, nothing is copied into memory
+            return np.load(spilled.path, mmap_mode="r")
+        with open(spilled.path, "rb") as f:
+            return pickle.load(f)
+
+    def __setitem__(self, idx: int, value: Any) -> None:
+        if isinstance(value, np.ndarray):
+            content, size = None, value.nbytes
+        elif is_typed(value):
+            content, size = None, 0
+        else:
+            content = to_content(value)
+            size = len(content)
+
+        with self._lock:
+            self._discard(idx)
+            if size > self.spill_size:
+                self._entries[idx] = (self._spill(idx, value, content), 0)
+                return
+            self._entries[idx] = (value, size)
+            self.memory += size
+            # Spill the oldest results until the rest fits
+            for old_idx in list(self._entries):
+                if self.memory <= self.memory_limit:
+                    break
+                old_value, old_size = self._entries[old_idx]
+                if old_size:
+                    self._entries[old_idx] = (self._spill(old_idx, old_value), 0)
+                    self.memory -= old_size
+
+    def __getitem__(self, idx: int) -> Any:
+        with self._lock:
+            value, _ = self._entries[idx]
+        return self._load(value) if isinstance(value, _Spilled) else value
+
+    def _discard(self, idx: int) -> None:
+        entry = self._entries.pop(idx, None)
+        self._messages.pop(idx, None)
+        if entry is None:
+            return
+        value, size = entry
+        self.memory -= size
+        if isinstance(value, _Spilled) and os.path.exists(value.path):
+            os.remove(value.path)
+
+    def __delitem__(self, idx: int) -> None:
+        with self._lock:
+            if idx not in self._entries:
+                raise KeyError(idx)
+            self._discard(idx)
+
+    def __contains__(self, idx: object) -> bool:
+        return idx in self._entries
+
+    def __iter__(self) -> Iterator[int]:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def message(self, idx: int, name: str, args: Any) -> FunctionMessage:
+        """The FunctionMessage of a result, built the first time it is asked for."""
+        with self._lock:
+            message = self._messages.get(idx)
+            if message is not None:
+                return message
+            value, _ = self._entries[idx]
+            if isinstance(value, _Spilled):
+                content, kwargs = value.preview, {"idx": idx, "args": args}
+            else:
+                content = self._preview(to_content(value))
+                kwargs = (
+                    {"idx": idx, "args": args, "value": value}
+                    if is_typed(value)
+                    else {"idx": idx, "args": args}
+                )
+            message = self._messages[idx] = FunctionMessage(
+                name=name, content=content, additional_kwargs=kwargs
+            )
+            return message
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "memory": self.memory,
+                "spilled": self.spilled,
+            }
+
+    def close(self) -> None:
+        """Delete the spilled results."""
+        with self._lock:
+            for idx in list(self._entries):
+                self._discard(idx)
+            if self._temporary_dir is not None:
+                self._temporary_dir.cleanup()
+                self._temporary_dir = None
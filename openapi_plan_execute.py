@@ -1,51 +1,74 @@
 import os
-import yaml
 import dotenv
 import asyncio
-import operator
+import uuid
 
-import spotipy.util as util
+from typing import Annotated, Dict, List, Optional, Sequence, Tuple, TypedDict, Union, Literal
 
-from typing import Annotated, List, Tuple, TypedDict, Union, Literal
-
-from langchain_community.agent_toolkits.openapi.spec import reduce_openapi_spec
-from langchain_community.utilities.requests import RequestsWrapper
 
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
 
 from langchain_groq import ChatGroq
 
-from langgraph.prebuilt import create_react_agent
 from langgraph.graph import StateGraph, START
 
-from prepare import prepare_tools, create_prompt, prepare_api_docs
-from prompts import API_PLANNER_PROMPT
+from api_controller_agent import create_api_controller_agent
+from batch_coalescer import BatchCoalescer
+from checkpointer import SqliteDeltaSaver
+from endpoint_retriever import EndpointRetriever
+from prepare import ControllerPrompt, EndpointIndex, prepare_tools
+from prompts import API_PLANNER_PROMPT, DAG_PLANNER_PROMPT
+from http_client import AsyncRequestsWrapper
+from paginator import Paginator
+from plan_cache import PlanCache
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from response_reducer import ResponseReducer
+from spec_loader import load_spec
+from token_manager import EncryptedTokenStore, TokenManager
 
 dotenv.load_dotenv(dotenv.find_dotenv(filename=".env"))
 
 os.environ["LANGCHAIN_TRACING_V2"] = "true"
 os.environ["LANGCHAIN_PROJECT"] = "Plan-and-execute"
 
-
-with open("spotify_openapi.yaml", "r", encoding="utf-8") as file:
-    raw_spotify_api_spec = yaml.safe_load(file)
-spotify_api_spec = reduce_openapi_spec(raw_spotify_api_spec)
-
-
-def construct_spotify_auth_headers(raw_spec: dict):
-    scopes = list(
-        raw_spec["components"]["securitySchemes"]["oauth_2_0"]["flows"][
-            "authorizationCode"
-        ]["scopes"].keys()
-    )
-    access_token = util.prompt_for_user_token(scope=",".join(scopes))
-    return {"Authorization": f"Bearer {access_token}"}
-
-
-# Get API credentials.
-headers = construct_spotify_auth_headers(raw_spotify_api_spec)
-requests_wrapper = RequestsWrapper(headers=headers)
+# "dag" runs independent plan steps concurrently and only replans on failure,
+# "sequential" executes one step at a time and replans after each of them
+PLANNING_MODE = os.environ.get("PLANNING_MODE", "dag")
+# Number of retrieved endpoints shown to the planner, tune with
+# `python endpoint_retriever.py`
+ENDPOINTS_TOP_K = int(os.environ.get("ENDPOINTS_TOP_K", "15"))
+# Past steps shown in full to the replanner, older ones are only summarized
+PAST_STEPS_WINDOW = int(os.environ.get("PAST_STEPS_WINDOW", "8"))
+# Length of the summary of the older steps
+PAST_STEPS_SUMMARY_CHARS = int(os.environ.get("PAST_STEPS_SUMMARY_CHARS", "1000"))
+# Items of a list the agent sees in an observation
+MAX_LIST_ITEMS = int(os.environ.get("MAX_LIST_ITEMS", "50"))
+# Items of a list fetched and kept in the paginator's buffer, the agent pages
+# through them with `offset` without new API requests
+MAX_PAGED_ITEMS = int(os.environ.get("MAX_PAGED_ITEMS", "5000"))
+
+
+spotify_spec = load_spec("spotify_openapi.yaml")
+spotify_api_spec = spotify_spec.api_spec
+spotify_endpoint_index = EndpointIndex(spotify_api_spec)
+
+
+# Tokens are kept per user and refreshed in the background before they expire
+token_manager = TokenManager(spotify_spec.scopes, EncryptedTokenStore())
+token_manager.start()
+requests_wrapper = AsyncRequestsWrapper(
+    header_provider=token_manager.headers,
+    # Replans and retries repeat the same GETs, serve them from the cache
+    cache=ResponseCache(),
+    # Requests wait for their budget and 429s are retried after Retry-After
+    rate_limiter=RateLimiter(endpoint_index=spotify_endpoint_index),
+    # Concurrent GET /tracks/{id} calls become one GET /tracks?ids=...
+    coalescer=BatchCoalescer(spotify_endpoint_index),
+    # List endpoints answer with all their pages, up to MAX_PAGED_ITEMS items
+    paginator=Paginator(spotify_endpoint_index, max_items=MAX_PAGED_ITEMS),
+)
 
 
 # Choose the LLM that will drive the agent
@@ -58,31 +81,52 @@ tools = prepare_tools(
     llm,
     allow_dangerous_requests=True,
     allowed_operations=("GET", "POST", "PUT", "DELETE", "PATCH"),
+    # Shrink responses by their schema instead of a second LLM call
+    response_reducer=ResponseReducer(spotify_endpoint_index, max_items=MAX_LIST_ITEMS),
 )
 
 
+EARLIER_STEPS = "Earlier steps"
+
+
+def window_past_steps(left: List[Tuple], right: List[Tuple]) -> List[Tuple]:
+    """Append the new steps, folding the oldest ones into a summary step.
+
+    Only the last `PAST_STEPS_WINDOW` steps keep their results. The steps
+    before them become one `(EARLIER_STEPS, summary)` step listing what was
+    done, cut to its last `PAST_STEPS_SUMMARY_CHARS` characters, so the
+    state and the replanner prompt stay bounded however long the plan runs.
+    """
+    steps = list(left) + list(right)
+    summary = ""
+    if steps and steps[0][0] == EARLIER_STEPS:
+        summary = steps.pop(0)[1]
+    if len(steps) <= PAST_STEPS_WINDOW:
+        return [(EARLIER_STEPS, summary), *steps] if summary else steps
+
+    folded, steps = steps[:-PAST_STEPS_WINDOW], steps[-PAST_STEPS_WINDOW:]
+    summary = "\n".join([summary, *(f"Done: {step}" for step, _ in folded)]).strip()
+    if len(summary) > PAST_STEPS_SUMMARY_CHARS:
+        summary = "..." + summary[-PAST_STEPS_SUMMARY_CHARS:]
+    return [(EARLIER_STEPS, summary), *steps]
+
+
 class PlanExecute(TypedDict):
     input: str
     plan: List[str]
-    past_steps: Annotated[List[Tuple], operator.add]
+    dag: List[dict]
+    past_steps: Annotated[List[Tuple], window_past_steps]
     response: str
 
 
-# TODO: Create prompt as state_modifier based on _create_api_controller_agent
-prompt = create_prompt(spotify_api_spec, tools)
-
-
-def state_modifier(state: PlanExecute):
-    # print(f"state is {state}")
-    # plan = state["plan"]
-    # plan_str = "\n".join(f"{i + 1}. {step}" for i, step in enumerate(plan))
-    plan_str = """-GET /me/playlists
-- GET /playlists/{playlist_id}/tracks?limit=5"""
+# Static system prompt rendered once, endpoint docs memoized per endpoint set
+state_modifier = ControllerPrompt(spotify_endpoint_index, tools)
 
-    return prompt.invoke({"api_docs": prepare_api_docs(plan_str, spotify_api_spec)})
 
-
-tool_executer = create_react_agent(model=llm, tools=tools, state_modifier=state_modifier)
+# Tool calls of one message run concurrently, a stuck request gets an error
+tool_executer = create_api_controller_agent(
+    model=llm, tools=tools, state_modifier=state_modifier, tool_timeout=60.0
+)
 
 
 class Plan(BaseModel):
@@ -93,9 +137,36 @@ class Plan(BaseModel):
     )
 
 
-endpoint_descriptions = [
-    f"{name} {description}" for name, description, _ in spotify_api_spec.endpoints
-]
+class PlanStep(BaseModel):
+    """Step of a plan and the steps whose results it needs"""
+
+    id: int = Field(description="position of the step in the plan, starting at 1")
+    step: str = Field(description="the API call to make and what it is for")
+    depends_on: List[int] = Field(
+        default_factory=list,
+        description="ids of the earlier steps whose results this step needs",
+    )
+
+
+class DagPlan(BaseModel):
+    """Plan to follow in future, with explicit dependencies between steps"""
+
+    steps: List[PlanStep] = Field(
+        description="different steps to follow, should be in sorted order"
+    )
+
+
+# Only the endpoints relevant to the request go in the planner prompt
+endpoint_retriever = EndpointRetriever(spotify_api_spec, spotify_spec.spec_hash)
+
+
+def retrieve_endpoints(query: str) -> str:
+    # Most plans start by resolving the user or searching for an item
+    descriptions = endpoint_retriever.describe(
+        query, ENDPOINTS_TOP_K, always_include=("GET /me", "GET /search")
+    )
+    return "- " + "- ".join(descriptions)
+
 
 planner_prompt = ChatPromptTemplate.from_messages([
     (
@@ -111,6 +182,20 @@ planner = planner_prompt | ChatGroq(
     temperature=0.0
 ).with_structured_output(Plan)
 
+dag_planner_prompt = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        API_PLANNER_PROMPT + DAG_PLANNER_PROMPT
+    ),
+    ("user", """User query: {messages}
+Plan:""")
+])
+
+dag_planner = dag_planner_prompt | ChatGroq(
+    model_name="llama-3.1-70b-versatile",
+    temperature=0.0
+).with_structured_output(DagPlan)
+
 
 class Response(BaseModel):
     """Response to user."""
@@ -159,42 +244,167 @@ rePlanner = rePlanner_prompt | ChatGroq(
 ).with_structured_output(Act)
 
 
-async def execute_step(state: PlanExecute):
-    # plan = state["plan"]
-    # task = plan[0]
-    # plan_str = "\n".join(f"{i + 1}. {step}" for i, step in enumerate(plan))
-    task = state["plan"][0]
+# Final answers of the controller that mean the step did not get what it needed
+AMBIGUOUS_RESULT_MARKERS = (
+    "sorry, need more steps",
+    "missing information",
+    "i cannot",
+    "unable to",
+)
+
+
+def is_ambiguous(result: str) -> bool:
+    result = result.strip().lower()
+    return not result or any(marker in result for marker in AMBIGUOUS_RESULT_MARKERS)
+
 
+async def run_task(task: str, dependency_results: Sequence[Tuple[str, str]] = ()) -> str:
+    context = "".join(
+        f"Result of {step}: {result}\n" for step, result in dependency_results
+    )
     agent_response = await tool_executer.ainvoke({
         "messages": [(
             "user",
             f"""Plan: {task}
-Thought:
+{context}Thought:
 {{agent_scratchpad}}"""
         )]
     })
 
+    return agent_response["messages"][-1].content
+
+
+async def execute_step(state: PlanExecute):
+    # plan = state["plan"]
+    # task = plan[0]
+    # plan_str = "\n".join(f"{i + 1}. {step}" for i, step in enumerate(plan))
+    task = state["plan"][0]
+
+    try:
+        result = await run_task(task)
+    except Exception:
+        # A plan that failed is not served again
+        plan_cache.discard(state["input"], namespace="sequential")
+        raise
+
     return {
-        "past_steps": [(task, agent_response["messages"][-1].content)],
+        "past_steps": [(task, result)],
     }
 
 
+async def execute_dag_step(state: PlanExecute):
+    steps = {step["id"]: step for step in state["dag"]}
+    results: Dict[int, str] = {}
+    runs: Dict[int, asyncio.Task] = {}
+
+    async def run(step: dict) -> Optional[str]:
+        # None means the step failed, was skipped or gave an unclear answer
+        dependency_results = []
+        for dependency in step["depends_on"]:
+            result = await runs[dependency]
+            if result is None:
+                results[step["id"]] = (
+                    f"Skipped: step {dependency} it depends on did not complete."
+                )
+                return None
+            dependency_results.append((steps[dependency]["step"], result))
+
+        try:
+            result = await run_task(step["step"], dependency_results)
+        except Exception as e:
+            results[step["id"]] = f"ERROR: {repr(e)}"
+            return None
+
+        results[step["id"]] = result
+        return None if is_ambiguous(result) else result
+
+    # Dependencies always point to earlier steps, so they are scheduled first
+    for step_id in sorted(steps):
+        runs[step_id] = asyncio.ensure_future(run(steps[step_id]))
+    outputs = dict(zip(runs, await asyncio.gather(*runs.values())))
+
+    past_steps = [(steps[step_id]["step"], results[step_id]) for step_id in runs]
+    if any(output is None for output in outputs.values()):
+        return {"past_steps": past_steps}
+
+    # Steps no other step depends on hold the answer
+    dependencies = {
+        dependency for step in steps.values() for dependency in step["depends_on"]
+    }
+    return {
+        "past_steps": past_steps,
+        "response": "\n".join(
+            outputs[step_id] for step_id in runs if step_id not in dependencies
+        ),
+    }
+
+
+# Repeated commands reuse their plan instead of calling the planner,
+# plans made for an older spec are dropped
+plan_cache = PlanCache(spotify_spec.spec_hash)
+
+
 async def plan_step(state: PlanExecute):
+    cached = plan_cache.get(state["input"], namespace="sequential")
+    if cached is not None:
+        return cached
+
     # plan = await planner.ainvoke({"messages": [("user", state["input"])]})
     plan = await planner.ainvoke({
         "messages": state["input"],
-        "endpoints": "- " + "- ".join(endpoint_descriptions)
+        "endpoints": retrieve_endpoints(state["input"])
     })
 
-    return {"plan": plan.steps}
+    update = {"plan": plan.steps}
+    plan_cache.put(state["input"], update, namespace="sequential")
+    return update
+
+
+async def dag_plan_step(state: PlanExecute):
+    cached = plan_cache.get(state["input"], namespace="dag")
+    if cached is not None:
+        return cached
+
+    plan = await dag_planner.ainvoke({
+        "messages": state["input"],
+        "endpoints": retrieve_endpoints(state["input"])
+    })
+
+    step_ids = {step.id for step in plan.steps}
+    dag = [
+        {
+            "id": step.id,
+            "step": step.step,
+            # Only keep edges to earlier, known steps so the graph is acyclic
+            "depends_on": sorted(
+                {
+                    dependency
+                    for dependency in step.depends_on
+                    if dependency in step_ids and dependency < step.id
+                }
+            ),
+        }
+        for step in sorted(plan.steps, key=lambda step: step.id)
+    ]
+
+    update = {"plan": [step["step"] for step in dag], "dag": dag}
+    plan_cache.put(state["input"], update, namespace="dag")
+    return update
 
 
 async def replan_step(state: PlanExecute):
+    if PLANNING_MODE == "dag":
+        # The DAG flow only replans when the plan failed, don't serve it again
+        plan_cache.discard(state["input"], namespace="dag")
+
     output = await rePlanner.ainvoke(state)
 
     if isinstance(output.action, Response):
         return {"response": output.action.response}
     else:
+        if PLANNING_MODE != "dag" and output.action.steps != state["plan"][1:]:
+            # The cached plan did not hold up, plan the command afresh next time
+            plan_cache.discard(state["input"], namespace="sequential")
         return {"plan": output.action.steps}
 
 
@@ -207,10 +417,14 @@ def should_end(state: PlanExecute) -> Literal["tool_executer", "__end__"]:
         return "tool_executer"
 
 
-workflow = StateGraph(PlanExecute)
+def should_replan(state: PlanExecute) -> Literal["replan", "__end__"]:
+    if "response" in state and state["response"]:
+        return "__end__"
+    else:
+        return "replan"
+
 
-# Add the plan node
-workflow.add_node("planner", plan_step)
+workflow = StateGraph(PlanExecute)
 
 # Add the execution step
 workflow.add_node("tool_executer", execute_step)
@@ -220,8 +434,23 @@ workflow.add_node("replan", replan_step)
 
 workflow.add_edge(START, "planner")
 
-# From plan we go to tool_executer
-workflow.add_edge("planner", "tool_executer")
+if PLANNING_MODE == "dag":
+    # Plan with dependencies and run independent steps concurrently
+    workflow.add_node("planner", dag_plan_step)
+    workflow.add_node("dag_executer", execute_dag_step)
+    workflow.add_edge("planner", "dag_executer")
+
+    # Replan only when a step failed or its result is unclear
+    workflow.add_conditional_edges(
+        "dag_executer",
+        should_replan,
+    )
+else:
+    # Add the plan node
+    workflow.add_node("planner", plan_step)
+
+    # From plan we go to tool_executer
+    workflow.add_edge("planner", "tool_executer")
 
 # From tool_executer, we replan
 workflow.add_edge("tool_executer", "replan")
@@ -234,21 +463,44 @@ workflow.add_conditional_edges(
 # Finally, we compile it!
 # This compiles it into a LangChain Runnable,
 # meaning you can use it as you would any other runnable
-app = workflow.compile()
+# Every step is checkpointed, an interrupted run resumes where it stopped
+checkpointer = SqliteDeltaSaver(os.environ.get("CHECKPOINT_DB", ".checkpoints.sqlite3"))
+app = workflow.compile(checkpointer=checkpointer)
 
 config = {"recursion_limit": 50}
 
 
+def run_config(thread_id: Optional[str] = None) -> dict:
+    """Config of a run, every command runs in its own checkpoint thread."""
+    return {**config, "configurable": {"thread_id": thread_id or str(uuid.uuid4())}}
+
+
 async def main():
+    # Asks for authorization in the browser only when no token is stored yet
+    token_manager.authorize()
+
     while True:
         # command = getpass.getpass("Command: ")
         command = input("Command: ")
 
-        inputs = {"input": command}
-
-        async for event in app.astream(inputs, config=config):
-            for k, v in event.items():
-                if k != "__end__":
-                    print(v)
-
-asyncio.run(main())
+        # `resume <thread id>` continues an interrupted run from its last step
+        if command.startswith("resume "):
+            inputs = None
+            run = run_config(command.split(" ", 1)[1].strip())
+        else:
+            inputs = {"input": command}
+            run = run_config()
+            print(f"Thread: {run['configurable']['thread_id']}")
+
+        try:
+            async for event in app.astream(inputs, config=run):
+                for k, v in event.items():
+                    if k != "__end__":
+                        print(v)
+        except Exception as e:
+            thread_id = run["configurable"]["thread_id"]
+            print(f"Run failed: {e!r}, continue it with `resume {thread_id}`")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,6 +5,7 @@ from typing import (
     Dict,
     Iterator,
     List,
+    Mapping,
     Optional,
     Sequence,
     Tuple,
@@ -14,6 +15,7 @@ from typing import (
 from langchain_core.exceptions import OutputParserException
 from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers.transform import BaseTransformOutputParser
+from langchain_core.pydantic_v1 import PrivateAttr
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import BaseTool
 from typing_extensions import TypedDict
@@ -24,6 +26,11 @@ ACTION_PATTERN = r"\n*(\d+)\. (\w+)\((.*)\)(\s*#\w+\n)?"
 ID_PATTERN = r"\$\{?(\d+)\}?"
 END_OF_PLAN = "<END_OF_PLAN>"
 
+_THOUGHT_REGEX = re.compile(THOUGHT_PATTERN)
+_ACTION_REGEX = re.compile(ACTION_PATTERN)
+_ID_REGEX = re.compile(ID_PATTERN)
+_ARG_DELIMITER_REGEX = re.compile(r"[\"'\\()\[\]{},=]")
+
 
 # Helper functions
 
@@ -35,71 +42,133 @@ def _ast_parse(arg: str) -> Any:
         return arg
 
 
-def _parse_llm_compiler_action_args(args: str, tool: Union[str, BaseTool]) -> list[Any]:
+def _get_tool_arg_names(
+    tool: BaseTool, cache: Optional[Dict[str, Tuple[str, ...]]] = None
+) -> Tuple[str, ...]:
+    # tool.args rebuilds the JSON schema on every access
+    if cache is None:
+        return tuple(tool.args.keys())
+    arg_names = cache.get(tool.name)
+    if arg_names is None:
+        arg_names = cache[tool.name] = tuple(tool.args.keys())
+    return arg_names
+
+
+def _split_action_args(args: str) -> Iterator[Tuple[Optional[str], str]]:
+    """Split arguments into (keyword or None, raw value) pairs in one scan.
+
+    Commas and `=` only count outside of quotes and brackets, so values such as
+    `"a, b=c"`, `["$1", "${2}"]` or `{"k": 1}` are kept whole. A quote only
+    opens a string at the start of a value or of an item within brackets, so
+    the apostrophe of an unquoted `what's 2+2` is just text.
+    """
+    depth = 0
+    quote = None
+    start = 0
+    key = None
+    escaped_at = -1
+    # Only look at the characters that can change the state
+    for match in _ARG_DELIMITER_REGEX.finditer(args):
+        i = match.start()
+        char = args[i]
+        if quote:
+            if i == escaped_at:
+                continue
+            if char == "\\":
+                escaped_at = i + 1
+            elif char == quote:
+                quote = None
+        elif char == '"' or char == "'":
+            before = args[start:i].rstrip()
+            if not before or (depth and before[-1] in "([{,:"):
+                quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            if char == ",":
+                yield key, args[start:i]
+                start = i + 1
+                key = None
+            elif (
+                char == "="
+                and key is None
+                and args[i + 1:i + 2] != "="
+                and args[start:i].strip().isidentifier()
+            ):
+                key = args[start:i].strip()
+                start = i + 1
+    if key is not None or args[start:].strip():
+        yield key, args[start:]
+
+
+def _parse_llm_compiler_action_args(
+    args: str,
+    tool: Union[str, BaseTool],
+    arg_names_cache: Optional[Dict[str, Tuple[str, ...]]] = None,
+) -> Union[Dict[str, Any], Tuple]:
     """Parse arguments from a string."""
     if args == "":
         return ()
     if isinstance(tool, str):
         return ()
+    arg_names = _get_tool_arg_names(tool, arg_names_cache)
     extracted_args = {}
-    tool_key = None
-    prev_idx = None
-    for key in tool.args.keys():
-        # Split if present
-        if f"{key}=" in args:
-            idx = args.index(f"{key}=")
-            if prev_idx is not None:
-                extracted_args[tool_key] = _ast_parse(
-                    args[prev_idx:idx].strip().rstrip(",")
-                )
-            args = args.split(f"{key}=", 1)[1]
-            tool_key = key
-            prev_idx = 0
-    if prev_idx is not None:
-        extracted_args[tool_key] = _ast_parse(
-            args[prev_idx:].strip().rstrip(",").rstrip(")")
-        )
+    positional_names = iter(arg_names)
+    for key, value in _split_action_args(args):
+        if key is not None and key not in arg_names:
+            # Not a parameter of this tool, keep the text as a positional value
+            value = f"{key}={value}"
+            key = None
+        if key is None:
+            key = next(
+                (name for name in positional_names if name not in extracted_args),
+                None,
+            )
+            if key is None:
+                continue
+        extracted_args[key] = _ast_parse(value.strip())
     return extracted_args
 
 
-def default_dependency_rule(idx, args: str):
-    matches = re.findall(ID_PATTERN, args)
-    numbers = [int(match) for match in matches]
-    return idx in numbers
-
-
 def _get_dependencies_from_graph(
     idx: int, tool_name: str, args: Dict[str, Any]
-) -> dict[str, list[str]]:
+) -> List[int]:
     """Get dependencies from a graph."""
-    if tool_name == "join":
-        return list(range(1, idx))
-    return [i for i in range(1, idx) if default_dependency_rule(i, str(args))]
+    # One scan for $N / ${N} references to earlier tasks. This also covers
+    # join, the scheduler already waits for every task before joining.
+    return sorted(
+        {dep for dep in map(int, _ID_REGEX.findall(str(args))) if 0 < dep < idx}
+    )
 
 
 class Task(TypedDict):
     idx: int
     tool: BaseTool
     args: list
-    dependencies: Dict[str, list]
+    dependencies: List[int]
     thought: Optional[str]
 
 
 def instantiate_task(
-    tools: Sequence[BaseTool],
+    tools: Union[Sequence[BaseTool], Mapping[str, BaseTool]],
     idx: int,
     tool_name: str,
     args: Union[str, Any],
     thought: Optional[str] = None,
+    arg_names_cache: Optional[Dict[str, Tuple[str, ...]]] = None,
 ) -> Task:
     if tool_name == "join":
         tool = "join"
     else:
+        if not isinstance(tools, Mapping):
+            tools = {tool.name: tool for tool in tools}
         try:
-            tool = tools[[tool.name for tool in tools].index(tool_name)]
-        except ValueError as e:
+            tool = tools[tool_name]
+        except KeyError as e:
             raise OutputParserException(f"Tool {tool_name} not found.") from e
-    tool_args = _parse_llm_compiler_action_args(args, tool)
+    tool_args = _parse_llm_compiler_action_args(args, tool, arg_names_cache)
     dependencies = _get_dependencies_from_graph(idx, tool_name, tool_args)
 
     return Task(
@@ -116,6 +185,10 @@ class LLMCompilerPlanParser(BaseTransformOutputParser[dict], extra="allow"):
 
     tools: List[BaseTool]
 
+    _tools_by_name: Dict[str, BaseTool] = PrivateAttr(default_factory=dict)
+    # Tool name -> argument names, for the tools of this parser only
+    _arg_names: Dict[str, Tuple[str, ...]] = PrivateAttr(default_factory=dict)
+
     def _transform(self, input: Iterator[Union[str, BaseMessage]]) -> Iterator[Task]:
         texts = []
         # TODO: Cleanup tuple state tracking here.
@@ -145,32 +218,38 @@ class LLMCompilerPlanParser(BaseTransformOutputParser[dict], extra="allow"):
     def ingest_token(
         self, token: str, buffer: List[str], thought: Optional[str]
     ) -> Iterator[Tuple[Optional[Task], str]]:
-        buffer.append(token)
-        if "\n" in token:
-            buffer_ = "".join(buffer).split("\n")
-            suffix = buffer_[-1]
-            for line in buffer_[:-1]:
-                task, thought = self._parse_task(line, thought)
-                if task:
-                    yield task, thought
-            buffer.clear()
-            buffer.append(suffix)
+        if "\n" not in token:
+            buffer.append(token)
+            return
+        # Only the new token is split, the buffer holds the start of its first line
+        lines = token.split("\n")
+        buffer.append(lines[0])
+        lines[0] = "".join(buffer)
+        buffer.clear()
+        buffer.append(lines.pop())
+        for line in lines:
+            task, thought = self._parse_task(line, thought)
+            if task:
+                yield task, thought
 
     def _parse_task(self, line: str, thought: Optional[str] = None):
         task = None
-        if match := re.match(THOUGHT_PATTERN, line):
+        if match := _THOUGHT_REGEX.match(line):
             # Optionally, action can be preceded by a thought
             thought = match.group(1)
-        elif match := re.match(ACTION_PATTERN, line):
+        elif match := _ACTION_REGEX.match(line):
             # if action is parsed, return the task, and clear the buffer
             idx, tool_name, args, _ = match.groups()
             idx = int(idx)
+            if not self._tools_by_name:
+                self._tools_by_name = {tool.name: tool for tool in self.tools}
             task = instantiate_task(
-                tools=self.tools,
+                tools=self._tools_by_name,
                 idx=idx,
                 tool_name=tool_name,
                 args=args,
                 thought=thought,
+                arg_names_cache=self._arg_names,
             )
             thought = None
         # Else it is just dropped
@@ -0,0 +1,329 @@
+import asyncio
+import json
+import httpx
+
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+if TYPE_CHECKING:
+    from prepare import EndpointIndex
+
+Send = Callable[..., Awaitable[httpx.Response]]
+
+# Query parameters that select a specific page, the caller then gets that page
+_PAGE_PARAMS = frozenset({"offset", "after", "before"})
+
+
+@dataclass
+class PagedRoute:
+    """A list endpoint answering with a Spotify paging object.
+
+    `key` is the field holding the paging object when it is wrapped, e.g.
+    "albums" for `GET /browse/new-releases`. Cursor-paged endpoints can only
+    be followed page by page through `next`.
+    """
+
+    name: str
+    key: Optional[str]
+    cursor: bool
+    page_size: int
+
+
+class PageError(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"Page request failed with status {response.status_code}")
+        self.response = response
+
+
+def _split_url(url: str, params: Optional[Mapping[str, Any]]) -> Tuple[str, Dict[str, str]]:
+    """Base URL and query of a request, `params` overriding the URL's query."""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.update({str(name): str(value) for name, value in (params or {}).items()})
+    return urlunsplit(parts._replace(query="")), query
+
+
+def _json_response(data: Any, url: str) -> httpx.Response:
+    return httpx.Response(
+        200,
+        headers={"content-type": "application/json"},
+        content=json.dumps(data).encode(),
+        request=httpx.Request("GET", url),
+    )
+
+
+def _properties(schema: dict) -> Set[str]:
+    properties = set(schema.get("properties", {}))
+    for sub_schema in schema.get("allOf", ()):
+        properties |= _properties(sub_schema)
+    return properties
+
+
+def _is_paging(schema: dict) -> bool:
+    properties = _properties(schema)
+    return "items" in properties and "next" in properties
+
+
+class Paginator:
+    """Fetches every page of a list endpoint as one response.
+
+    Paged endpoints are found by their response schema in the spec. Offset
+    paged endpoints fetch the first page, then prefetch the following pages
+    `concurrency` at a time. Cursor paged endpoints follow `next`. Fetching
+    stops at `max_items` items, or the `limit` the caller asked for, the last
+    page only asking for the items left. Requests for an explicit `offset` or
+    cursor are left alone.
+
+    The items of the last `buffer_size` offset paged lists are kept in a side
+    buffer. The observation the agent sees is reduced to a few items, and its
+    requests for the following pages (`offset=...`) are answered from the
+    buffer by `buffered` instead of the API.
+    """
+
+    def __init__(
+        self,
+        endpoint_index: "EndpointIndex",
+        max_items: int = 200,
+        page_size: int = 50,
+        page_sizes: Optional[Dict[str, int]] = None,
+        concurrency: int = 4,
+        buffer_size: int = 8,
+    ):
+        self.endpoint_index = endpoint_index
+        self.max_items = max_items
+        self.concurrency = concurrency
+        self.buffer_size = buffer_size
+        self.pages = 0
+        self.buffer_hits = 0
+        # List key -> (paging object without its items, items, route), oldest first
+        self._buffers: "OrderedDict[tuple, Tuple[Dict[str, Any], List[Any], PagedRoute]]" = (
+            OrderedDict()
+        )
+        self._routes: Dict[str, Optional[PagedRoute]] = {}
+        self._page_size = page_size
+        self._page_sizes = {"GET /playlists/{playlist_id}/tracks": 100, **(page_sizes or {})}
+
+    def _get_route(self, name: str) -> Optional[PagedRoute]:
+        if name in self._routes:
+            return self._routes[name]
+
+        schema = self.endpoint_index.response_schema(name)
+        route = None
+        key = None
+        if not _is_paging(schema):
+            # Only a paging object wrapped alone, e.g. {"albums": {...}}
+            wrapped = schema.get("properties", {})
+            if len(wrapped) == 1:
+                key, schema = next(iter(wrapped.items()))
+        if _is_paging(schema):
+            route = PagedRoute(
+                name=name,
+                key=key,
+                cursor="cursors" in _properties(schema),
+                page_size=self._page_sizes.get(name, self._page_size),
+            )
+        self._routes[name] = route
+        return route
+
+    def route(self, url: str, params: Optional[Mapping[str, Any]] = None) -> Optional[PagedRoute]:
+        query = {name for name, _ in parse_qsl(urlsplit(url).query)}
+        if _PAGE_PARAMS & (query | set(params or ())):
+            return None
+        name = self.endpoint_index.find_url("GET", url)
+        return None if name is None else self._get_route(name)
+
+    async def _fetch(
+        self,
+        send: Send,
+        url: str,
+        params: Optional[Dict[str, str]],
+        headers: Dict[str, str],
+        route: PagedRoute,
+    ) -> Dict[str, Any]:
+        self.pages += 1
+        response = await send("GET", url, headers=headers, params=params)
+        if response.status_code != 200:
+            raise PageError(response)
+        data = response.json()
+        return data if route.key is None else data[route.key]
+
+    async def iter_pages(
+        self,
+        send: Send,
+        url: str,
+        params: Optional[Mapping[str, Any]],
+        headers: Dict[str, str],
+        max_items: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the paging objects of a list endpoint, in order."""
+        route = self.route(url, params)
+        base_url, query = _split_url(url, params)
+
+        limit = max_items or self.max_items
+        try:
+            requested = int(query.get("limit", limit))
+        except ValueError:
+            # e.g. limit="all" from the LLM, use the default
+            requested = limit
+        if requested > 0:
+            limit = min(limit, requested)
+        page_size = min(route.page_size, limit)
+        query["limit"] = str(page_size)
+
+        page = await self._fetch(send, base_url, query, headers, route)
+        yield page
+        fetched = len(page["items"])
+
+        if route.cursor:
+            while page.get("next") and fetched < limit:
+                # The last page only asks for what is left of the limit
+                page = await self._fetch(
+                    send,
+                    page["next"],
+                    {"limit": str(min(page_size, limit - fetched))},
+                    headers,
+                    route,
+                )
+                yield page
+                fetched += len(page["items"])
+            return
+
+        end = min(page.get("total") or 0, limit)
+        offsets = iter(range(page_size, end, page_size))
+        in_flight: deque = deque()
+
+        def prefetch() -> None:
+            for offset in offsets:
+                page_query = {
+                    **query,
+                    "offset": str(offset),
+                    "limit": str(min(page_size, end - offset)),
+                }
+                in_flight.append(
+                    asyncio.ensure_future(
+                        self._fetch(send, base_url, page_query, headers, route)
+                    )
+                )
+                if len(in_flight) >= self.concurrency:
+                    break
+
+        prefetch()
+        try:
+            while in_flight:
+                page = await in_flight.popleft()
+                prefetch()
+                yield page
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def iter_items(
+        self,
+        send: Send,
+        url: str,
+        params: Optional[Mapping[str, Any]],
+        headers: Dict[str, str],
+        max_items: Optional[int] = None,
+    ) -> AsyncIterator[Any]:
+        """Yield the items of a list endpoint as their pages arrive."""
+        async for page in self.iter_pages(send, url, params, headers, max_items):
+            for item in page["items"]:
+                yield item
+
+    @staticmethod
+    def _buffer_key(base_url: str, query: Dict[str, str], headers: Dict[str, str]) -> tuple:
+        # Pages of the same list, for the same user
+        return (
+            base_url,
+            tuple(sorted((k, v) for k, v in query.items() if k not in ("limit", "offset"))),
+            tuple(sorted(headers.items())),
+        )
+
+    def buffered(
+        self,
+        url: str,
+        params: Optional[Mapping[str, Any]],
+        headers: Dict[str, str],
+    ) -> Optional[httpx.Response]:
+        """Answer a request for a page of a buffered list, None if it is not there."""
+        base_url, query = _split_url(url, params)
+        if "offset" not in query or "after" in query or "before" in query:
+            return None
+        key = self._buffer_key(base_url, query, headers)
+        entry = self._buffers.get(key)
+        if entry is None:
+            return None
+        meta, items, route = entry
+        try:
+            offset = int(query["offset"])
+            limit = int(query.get("limit", route.page_size))
+        except ValueError:
+            return None
+        total = meta.get("total") or len(items)
+        stop = min(offset + limit, total)
+        if offset < 0 or limit <= 0 or stop > len(items):
+            # Past the cap of the buffered items, the API has them
+            return None
+
+        self._buffers.move_to_end(key)
+        self.buffer_hits += 1
+        page = {
+            **meta,
+            "items": items[offset:stop],
+            "offset": offset,
+            "limit": limit,
+            "next": None
+            if stop >= total
+            else f"{base_url}?{urlencode({**query, 'offset': stop, 'limit': limit})}",
+        }
+        return _json_response(page if route.key is None else {route.key: page}, url)
+
+    async def get(
+        self,
+        send: Send,
+        url: str,
+        params: Optional[Mapping[str, Any]],
+        headers: Dict[str, str],
+    ) -> httpx.Response:
+        """GET every page and answer as if it were one big page."""
+        route = self.route(url, params)
+        merged: Optional[Dict[str, Any]] = None
+        items = []
+        try:
+            async for page in self.iter_pages(send, url, params, headers):
+                if merged is None:
+                    merged = dict(page)
+                items.extend(page["items"])
+                # `next` points after the last page fetched
+                merged["next"] = page.get("next")
+                if "cursors" in page:
+                    merged["cursors"] = page["cursors"]
+        except PageError as e:
+            if merged is None:
+                return e.response
+
+        if not route.cursor and self.buffer_size > 0:
+            base_url, query = _split_url(url, params)
+            key = self._buffer_key(base_url, query, headers)
+            self._buffers[key] = ({**merged, "items": None}, items, route)
+            self._buffers.move_to_end(key)
+            if len(self._buffers) > self.buffer_size:
+                self._buffers.popitem(last=False)
+
+        merged["items"] = items
+        merged["limit"] = len(items)
+        return _json_response(merged if route.key is None else {route.key: merged}, url)
@@ -0,0 +1,162 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from spec_loader import CACHE_DIR
+
+Embedding = Callable[[str], Sequence[float]]
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase the query and drop punctuation and repeated whitespace."""
+    return " ".join(_WORD_PATTERN.findall(query.lower()))
+
+
+def _cosine(left: Dict[str, float], right: Dict[str, float]) -> float:
+    dot = sum(value * right.get(key, 0.0) for key, value in left.items())
+    norm = math.sqrt(sum(v * v for v in left.values()) * sum(v * v for v in right.values()))
+    return dot / norm if norm else 0.0
+
+
+class PlanCache:
+    """SQLite cache of planner outputs keyed by the normalized user query.
+
+    A lookup first tries the exact normalized query. With an `embed` model it
+    then tries the most similar cached query whose embedding cosine similarity
+    reaches `similarity_threshold`; without one only exact matches are served,
+    as bags of words rate "add it to my kitchen playlist" and "add it to my
+    bedroom playlist" closer than most paraphrases. Plans made for another
+    spec hash are dropped when the cache is opened, and the least recently
+    used plans are evicted past `max_entries`.
+    """
+
+    def __init__(
+        self,
+        spec_hash: str,
+        path: str = os.path.join(CACHE_DIR, "plans.sqlite3"),
+        max_entries: int = 1000,
+        similarity_threshold: float = 0.95,
+        embed: Optional[Embedding] = None,
+    ):
+        self.spec_hash = spec_hash
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS plans (
+                    namespace TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    spec_hash TEXT NOT NULL,
+                    vector TEXT NOT NULL,
+                    plan TEXT NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (namespace, query)
+                )
+                """
+            )
+            self._connection.execute(
+                "DELETE FROM plans WHERE spec_hash != ?", (spec_hash,)
+            )
+
+    def _vector(self, query: str) -> Dict[str, float]:
+        if self.embed is None:
+            return {}
+        return {str(i): float(value) for i, value in enumerate(self.embed(query))}
+
+    def get(self, query: str, namespace: str = "") -> Optional[Dict[str, Any]]:
+        """Return the cached plan for the query, or None on a miss."""
+        normalized = normalize_query(query)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT query, plan FROM plans WHERE namespace = ? AND query = ?",
+                (namespace, normalized),
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+            else:
+                row = None if self.embed is None else self._most_similar(normalized, namespace)
+                if row is None:
+                    self.misses += 1
+                    return None
+                self.similar_hits += 1
+
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE plans SET hits = hits + 1, last_used = ? "
+                    "WHERE namespace = ? AND query = ?",
+                    (time.time(), namespace, row[0]),
+                )
+            return json.loads(row[1])
+
+    def _most_similar(self, normalized: str, namespace: str) -> Optional[tuple]:
+        vector = self._vector(normalized)
+        best, best_score = None, self.similarity_threshold
+        for query, cached_vector, plan in self._connection.execute(
+            "SELECT query, vector, plan FROM plans WHERE namespace = ?", (namespace,)
+        ):
+            score = _cosine(vector, json.loads(cached_vector))
+            if score >= best_score:
+                best, best_score = (query, plan), score
+        return best
+
+    def put(self, query: str, plan: Dict[str, Any], namespace: str = "") -> None:
+        """Store a plan, evicting the least recently used ones when full."""
+        normalized = normalize_query(query)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO plans "
+                "(namespace, query, spec_hash, vector, plan, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    namespace,
+                    normalized,
+                    self.spec_hash,
+                    json.dumps(self._vector(normalized)),
+                    json.dumps(plan),
+                    time.time(),
+                ),
+            )
+            self._connection.execute(
+                "DELETE FROM plans WHERE rowid IN ("
+                "SELECT rowid FROM plans ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def discard(self, query: str, namespace: str = "") -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM plans WHERE namespace = ? AND query = ?",
+                (namespace, normalize_query(query)),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (entries,) = self._connection.execute("SELECT COUNT(*) FROM plans").fetchone()
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,17 +1,12 @@
 import os
-import yaml
 import dotenv
 import asyncio
 import operator
 
-import spotipy.util as util
-
 from typing import Annotated, List, Tuple, TypedDict, Union, Literal
 
 from langchain import hub
 
-from langchain_community.agent_toolkits.openapi.spec import reduce_openapi_spec
-from langchain_community.utilities.requests import RequestsWrapper
 from langchain_community.tools.tavily_search import TavilySearchResults
 
 from langchain_core.pydantic_v1 import BaseModel, Field
@@ -22,6 +17,10 @@ from langchain_groq import ChatGroq
 from langgraph.prebuilt import create_react_agent
 from langgraph.graph import StateGraph, START
 
+from http_client import AsyncRequestsWrapper
+from spec_loader import load_spec
+from token_manager import EncryptedTokenStore, TokenManager
+
 
 dotenv.load_dotenv(dotenv.find_dotenv(filename=".env"))
 
@@ -29,24 +28,14 @@ os.environ["LANGCHAIN_TRACING_V2"] = "true"
 os.environ["LANGCHAIN_PROJECT"] = "Plan-and-execute"
 
 
-with open("spotify_openapi.yaml", "r", encoding="utf-8") as file:
-    raw_spotify_api_spec = yaml.safe_load(file)
-spotify_api_spec = reduce_openapi_spec(raw_spotify_api_spec)
-
-
-def construct_spotify_auth_headers(raw_spec: dict):
-    scopes = list(
-        raw_spec["components"]["securitySchemes"]["oauth_2_0"]["flows"][
-            "authorizationCode"
-        ]["scopes"].keys()
-    )
-    access_token = util.prompt_for_user_token(scope=",".join(scopes))
-    return {"Authorization": f"Bearer {access_token}"}
+spotify_spec = load_spec("spotify_openapi.yaml")
+spotify_api_spec = spotify_spec.api_spec
 
 
-# Get API credentials.
-headers = construct_spotify_auth_headers(raw_spotify_api_spec)
-requests_wrapper = RequestsWrapper(headers=headers)
+# Tokens are kept per user and refreshed in the background before they expire
+token_manager = TokenManager(spotify_spec.scopes, EncryptedTokenStore())
+token_manager.start()
+requests_wrapper = AsyncRequestsWrapper(header_provider=token_manager.headers)
 
 # Choose the LLM that will drive the agent
 # llm = ChatGroq(model_name="gemma2-9b-it", temperature=0.0)
@@ -243,6 +232,9 @@ config = {"recursion_limit": 50}
 
 
 async def main():
+    # Asks for authorization in the browser only when no token is stored yet
+    token_manager.authorize()
+
     while True:
         # command = getpass.getpass("Command: ")
         command = input("Command: ")
@@ -1,10 +1,13 @@
 import re
+import threading
 import yaml
 
-from typing import List, Literal, Sequence
+from collections import OrderedDict
+from typing import Dict, List, Literal, Optional, Pattern, Sequence, Set, Tuple, Union
+from urllib.parse import urlsplit
 
 from langchain_core.language_models import BaseLanguageModel
-from langchain_core.prompts import PromptTemplate
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from langchain_core.tools import BaseTool
 
 from langchain_community.agent_toolkits.openapi.planner_prompt import (
@@ -14,19 +17,23 @@ from langchain_community.agent_toolkits.openapi.planner_prompt import (
     PARSING_POST_PROMPT,
     PARSING_PUT_PROMPT,
 )
-from langchain_community.agent_toolkits.openapi.planner import (
-    RequestsGetToolWithParsing,
-    RequestsPostToolWithParsing,
-    RequestsPatchToolWithParsing,
-    RequestsPutToolWithParsing,
-    RequestsDeleteToolWithParsing
-)
 from langchain_community.agent_toolkits.openapi.spec import ReducedOpenAPISpec
 from langchain_community.utilities.requests import RequestsWrapper
 
 from langgraph.prebuilt.chat_agent_executor import StateModifier
 
-from prompts import API_CONTROLLER_PROMPT
+from prompts import (
+    API_CONTROLLER_DOCS_PROMPT,
+    API_CONTROLLER_PREFIX_PROMPT,
+)
+from request_tools import (
+    RequestsGetTool,
+    RequestsPostTool,
+    RequestsPatchTool,
+    RequestsPutTool,
+    RequestsDeleteTool
+)
+from response_reducer import ResponseReducer
 
 Operation = Literal["GET", "POST", "PUT", "DELETE", "PATCH"]
 
@@ -36,52 +43,64 @@ def prepare_tools(
     llm: BaseLanguageModel,
     allow_dangerous_requests: bool,
     allowed_operations: Sequence[Operation],
+    response_reducer: Optional[ResponseReducer] = None,
+    parse_with_llm: bool = False,
 ) -> List[BaseTool]:
     tools: List[BaseTool] = []
 
     if "GET" in allowed_operations:
         get_llm_chain = PARSING_GET_PROMPT | llm
         tools.append(
-            RequestsGetToolWithParsing(  # type: ignore[call-arg]
+            RequestsGetTool(  # type: ignore[call-arg]
                 requests_wrapper=requests_wrapper,
                 llm_chain=get_llm_chain,
                 allow_dangerous_requests=allow_dangerous_requests,
+                response_reducer=response_reducer,
+                parse_with_llm=parse_with_llm,
             )
         )
     if "POST" in allowed_operations:
         post_llm_chain = PARSING_POST_PROMPT | llm
         tools.append(
-            RequestsPostToolWithParsing(  # type: ignore[call-arg]
+            RequestsPostTool(  # type: ignore[call-arg]
                 requests_wrapper=requests_wrapper,
                 llm_chain=post_llm_chain,
                 allow_dangerous_requests=allow_dangerous_requests,
+                response_reducer=response_reducer,
+                parse_with_llm=parse_with_llm,
             )
         )
     if "PUT" in allowed_operations:
         put_llm_chain = PARSING_PUT_PROMPT | llm
         tools.append(
-            RequestsPutToolWithParsing(  # type: ignore[call-arg]
+            RequestsPutTool(  # type: ignore[call-arg]
                 requests_wrapper=requests_wrapper,
                 llm_chain=put_llm_chain,
                 allow_dangerous_requests=allow_dangerous_requests,
+                response_reducer=response_reducer,
+                parse_with_llm=parse_with_llm,
             )
         )
     if "DELETE" in allowed_operations:
         delete_llm_chain = PARSING_DELETE_PROMPT | llm
         tools.append(
-            RequestsDeleteToolWithParsing(  # type: ignore[call-arg]
+            RequestsDeleteTool(  # type: ignore[call-arg]
                 requests_wrapper=requests_wrapper,
                 llm_chain=delete_llm_chain,
                 allow_dangerous_requests=allow_dangerous_requests,
+                response_reducer=response_reducer,
+                parse_with_llm=parse_with_llm,
             )
         )
     if "PATCH" in allowed_operations:
         patch_llm_chain = PARSING_PATCH_PROMPT | llm
         tools.append(
-            RequestsPatchToolWithParsing(  # type: ignore[call-arg]
+            RequestsPatchTool(  # type: ignore[call-arg]
                 requests_wrapper=requests_wrapper,
                 llm_chain=patch_llm_chain,
                 allow_dangerous_requests=allow_dangerous_requests,
+                response_reducer=response_reducer,
+                parse_with_llm=parse_with_llm,
             )
         )
     if not tools:
@@ -90,34 +109,124 @@ def prepare_tools(
     return tools
 
 
-def create_prompt(
-    api_spec: ReducedOpenAPISpec,
-    tools: List[BaseTool],
-) -> StateModifier:
-    api_url = api_spec.servers[0]["url"]
+_PATH_PARAM_PATTERN = re.compile(r"\{.*?\}")
+_ENDPOINT_PATTERN = re.compile(r"\b(GET|POST|PATCH|DELETE|PUT)\s+(/\S+)*")
+
+
+def _route_key(method: str, route: str) -> Tuple[str, str]:
+    # Templated first segments (e.g. /{id}) can match anything
+    first_segment = route.lstrip("/").split("/", 1)[0]
+    return method, "" if "{" in first_segment else first_segment
+
+
+class EndpointIndex:
+    """Lookup table over the endpoints of a `ReducedOpenAPISpec`.
+
+    Routes are bucketed by method and by their first static path segment, so a
+    lookup only tries the handful of templated routes that can match. Docs are
+    rendered to YAML once per endpoint, the first time they are requested.
+    """
+
+    def __init__(self, api_spec: ReducedOpenAPISpec):
+        self.api_spec = api_spec
+        self._positions: Dict[str, int] = {}
+        self._docs: Dict[str, str] = {}
+        self._static: Set[str] = set()
+        self._templated: Dict[Tuple[str, str], List[Tuple[Pattern, str]]] = {}
+        self._prefix: Dict[str, List[Tuple[Pattern, str]]] = {}
+
+        servers = api_spec.servers
+        self._base_path = urlsplit(servers[0]["url"]).path.rstrip("/") if servers else ""
+
+        # LazyEndpoints (spec_loader) exposes the names without loading the docs
+        names = getattr(api_spec.endpoints, "names", None)
+        if names is None:
+            names = [name for name, _, _ in api_spec.endpoints]
+
+        for position, name in enumerate(names):
+            self._positions[name] = position
+
+            method, route = name.split(" ", 1)
+            # Previous behaviour of prepare_api_docs, kept as a fallback for
+            # sloppy plan steps (trailing punctuation, extra path segments...)
+            self._prefix.setdefault(method, []).append(
+                (re.compile(_PATH_PARAM_PATTERN.sub(".*", name)), name)
+            )
+
+            if "{" not in route:
+                self._static.add(name)
+                continue
+            route_regex = re.compile(
+                re.escape(method) + " " + _PATH_PARAM_PATTERN.sub("[^/]+", route)
+            )
+            self._templated.setdefault(_route_key(method, route), []).append(
+                (route_regex, name)
+            )
+
+        # Most specific routes first, e.g. /playlists/{id}/tracks before /{id}
+        for routes in self._templated.values():
+            routes.sort(key=lambda route: -route[1].count("/"))
+
+    def find(self, endpoint_name: str) -> List[str]:
+        """Return the spec endpoint names matching a `METHOD /route` string."""
+        if endpoint_name in self._static:
+            return [endpoint_name]
 
-    prompt = PromptTemplate(
-        template=API_CONTROLLER_PROMPT,
-        # input_variables=["plan_str", "agent_scratchpad"],
-        input_variables=["api_docs"],
-        partial_variables={
-            "api_url": api_url,
-            "tool_names": ", ".join([tool.name for tool in tools]),
-            "tool_descriptions": "\n".join(
-                [f"{tool.name}: {tool.description}" for tool in tools]
-            ),
-        },
-    )
+        method, _, route = endpoint_name.partition(" ")
+        route = route.rstrip("/") or "/"
+        if f"{method} {route}" in self._static:
+            return [f"{method} {route}"]
 
-    return prompt
+        for key in (_route_key(method, route), (method, "")):
+            for route_regex, name in self._templated.get(key, ()):
+                if route_regex.fullmatch(f"{method} {route}"):
+                    return [name]
+
+        return [
+            name
+            for route_regex, name in self._prefix.get(method, ())
+            if route_regex.match(endpoint_name)
+        ]
+
+    def find_url(self, method: str, url: str) -> Optional[str]:
+        """Return the spec endpoint name a request URL is sent to, if any."""
+        path = urlsplit(url).path
+        if self._base_path and path.startswith(self._base_path):
+            path = path[len(self._base_path):]
+        names = self.find(f"{method} {path}")
+        return names[0] if names else None
+
+    def raw_docs(self, name: str) -> dict:
+        """Return the docs of a spec endpoint as found in the reduced spec."""
+        _, _, docs = self.api_spec.endpoints[self._positions[name]]
+        return docs
+
+    def response_schema(self, name: str) -> dict:
+        """Return the JSON schema of the response of a spec endpoint, {} if none."""
+        return (
+            self.raw_docs(name)
+            .get("responses", {})
+            .get("content", {})
+            .get("application/json", {})
+            .get("schema")
+            or {}
+        )
+
+    def docs(self, name: str) -> str:
+        """Return the rendered docs of a spec endpoint."""
+        docs = self._docs.get(name)
+        if docs is None:
+            docs = self._docs[name] = yaml.dump(self.raw_docs(name))
+        return docs
 
 
 def prepare_api_docs(
     plan_str: str,
-    api_spec: ReducedOpenAPISpec,
+    api_spec: Union[ReducedOpenAPISpec, EndpointIndex],
 ) -> StateModifier:
-    pattern = r"\b(GET|POST|PATCH|DELETE|PUT)\s+(/\S+)*"
-    matches = re.findall(pattern, plan_str)
+    if not isinstance(api_spec, EndpointIndex):
+        api_spec = EndpointIndex(api_spec)
+    matches = _ENDPOINT_PATTERN.findall(plan_str)
 
     endpoint_names = [
         "{method} {route}".format(method=method, route=route.split("?")[0])
@@ -126,16 +235,87 @@ def prepare_api_docs(
 
     api_docs = ""
     for endpoint_name in endpoint_names:
-        found_match = False
+        found_names = api_spec.find(endpoint_name)
+        if not found_names:
+            raise ValueError(f"{endpoint_name} endpoint does not exist.")
 
-        for name, _, docs in api_spec.endpoints:
-            regex_name = re.compile(re.sub(r"\{.*?\}", ".*", name))
+        for name in found_names:
+            api_docs += f"== Docs for {endpoint_name} == \n{api_spec.docs(name)}\n"
 
-            if regex_name.match(endpoint_name):
-                found_match = True
-                api_docs += f"== Docs for {endpoint_name} == \n{yaml.dump(docs)}\n"
+    return api_docs
 
-        if not found_match:
-            raise ValueError(f"{endpoint_name} endpoint does not exist.")
 
-    return api_docs
+class ControllerPrompt:
+    """State modifier building the controller agent's messages.
+
+    The messages are the static system prompt (instructions, base url and
+    tools), rendered once, then the docs of the endpoints named in the task,
+    memoized per set of spec endpoints (the last `max_docs` sets), then the
+    agent's messages. The leading messages stay byte-identical between the
+    iterations of a ReAct loop, and between tasks calling the same endpoints
+    with other IDs, so providers with prompt caching only bill the new
+    messages in full.
+    """
+
+    def __init__(
+        self,
+        api_spec: Union[ReducedOpenAPISpec, EndpointIndex],
+        tools: List[BaseTool],
+        max_docs: int = 256,
+    ):
+        if not isinstance(api_spec, EndpointIndex):
+            api_spec = EndpointIndex(api_spec)
+        self.endpoint_index = api_spec
+        self.max_docs = max_docs
+        self.prefix = SystemMessage(
+            content=API_CONTROLLER_PREFIX_PROMPT.format(
+                api_url=api_spec.api_spec.servers[0]["url"],
+                tool_names=", ".join([tool.name for tool in tools]),
+                tool_descriptions="\n".join(
+                    [f"{tool.name}: {tool.description}" for tool in tools]
+                ),
+            )
+        )
+        # Spec endpoint names -> docs message, least recently used first
+        self._docs: "OrderedDict[Tuple[str, ...], SystemMessage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def api_docs(self, plan_str: str) -> SystemMessage:
+        # Routes in plans carry concrete IDs, the memo is keyed by spec names
+        names: Dict[str, None] = {}
+        for method, route in _ENDPOINT_PATTERN.findall(plan_str):
+            endpoint_name = f"{method} {route.split('?')[0]}"
+            found_names = self.endpoint_index.find(endpoint_name)
+            if not found_names:
+                # Let the agent see the mistake instead of failing the step
+                return SystemMessage(
+                    content=API_CONTROLLER_DOCS_PROMPT.format(
+                        api_docs=f"{endpoint_name} endpoint does not exist."
+                    )
+                )
+            names.update(dict.fromkeys(found_names))
+
+        key = tuple(names)
+        with self._lock:
+            docs = self._docs.get(key)
+            if docs is not None:
+                self._docs.move_to_end(key)
+                return docs
+        api_docs = "".join(
+            f"== Docs for {name} == \n{self.endpoint_index.docs(name)}\n" for name in key
+        )
+        docs = SystemMessage(content=API_CONTROLLER_DOCS_PROMPT.format(api_docs=api_docs))
+        with self._lock:
+            self._docs[key] = docs
+            if len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+        return docs
+
+    def __call__(self, state: dict) -> List[BaseMessage]:
+        messages = state["messages"]
+        # The first line of the task message holds the plan step
+        task = next(
+            (message.content for message in messages if isinstance(message, HumanMessage)),
+            "",
+        )
+        return [self.prefix, self.api_docs(task.split("\n", 1)[0]), *messages]
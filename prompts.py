@@ -54,14 +54,13 @@ Here are endpoints you can use. Do not reference any of the endpoints above.
 
 {endpoints}"""
 
-API_CONTROLLER_PROMPT = """You are an agent that gets a sequence of API calls and given their documentation, should execute them and return the final response.
+# The controller's system prompt is a static prefix, identical for every call
+# so providers can cache it, and the documentation of the endpoints of a plan
+API_CONTROLLER_PREFIX_PROMPT = """You are an agent that gets a sequence of API calls and given their documentation, should execute them and return the final response.
 If you cannot complete them and run into issues, you should explain the issue. If you're unable to resolve an API call, you can retry the API call. When interacting with API objects, you should extract ids for inputs to other API calls but ids and names for outputs returned to the User.
 
 
-Here is documentation on the API:
-Base url: {api_url}
-Endpoints:
-{api_docs}
+Base url of the API: {api_url}
 
 
 Here are tools to execute requests against the API: {tool_descriptions}
@@ -78,3 +77,21 @@ Observation: the output of the action
 Thought: I am finished executing the plan (or, I cannot finish executing the plan without knowing some other information.)
 Final Answer: the final output from executing the plan or missing information I'd need to re-plan correctly.
 """
+
+API_CONTROLLER_DOCS_PROMPT = """Here is documentation on the API endpoints of the plan:
+{api_docs}"""
+
+DAG_PLANNER_PROMPT = """
+
+----
+
+Write each API call of the plan as a separate step with an id, starting at 1.
+For every step, list in depends_on the ids of the earlier steps whose results it needs, e.g. an id or a name the step uses.
+Steps that do not need each other's results must not depend on each other, they are executed at the same time.
+
+Example:
+User query: I want to add a lamp to my cart
+Plan:
+1. GET /products with a query param to search for lamps, depends on: none
+2. GET /user to find the user's id, depends on: none
+3. PATCH /users/{{id}}/cart to add the lamp to the user's cart, depends on: 1, 2"""
@@ -0,0 +1,163 @@
+import asyncio
+import email.utils
+import threading
+import time
+
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    from prepare import EndpointIndex
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`.
+
+    Tokens are reserved even when the bucket is empty, the balance then goes
+    negative and tells the caller how long to wait, so callers are served in
+    arrival order without an explicit queue.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """Take a token and return the seconds until it is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+def parse_retry_after(value: Optional[str], default: float = 1.0) -> float:
+    """Seconds to wait from a `Retry-After` header, in seconds or as a date."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimiter:
+    """Client-side global and per-endpoint token buckets.
+
+    Every request takes a token from the global bucket and from the bucket of
+    its endpoint, and waits until both are available. A 429 response blocks
+    every request for its `Retry-After` delay, since Spotify rate limits the
+    whole app. `endpoint_limits` overrides the `(rate, burst)` of endpoints by
+    spec name, e.g. `{"GET /search": (2, 5)}`.
+
+    `queue_depth` is the number of requests currently waiting.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = 20.0,
+        endpoint_rate: float = 5.0,
+        endpoint_burst: float = 10.0,
+        endpoint_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        endpoint_index: Optional["EndpointIndex"] = None,
+        max_retries: int = 3,
+    ):
+        self.endpoint_rate = endpoint_rate
+        self.endpoint_burst = endpoint_burst
+        self.endpoint_limits = endpoint_limits or {}
+        self.endpoint_index = endpoint_index
+        self.max_retries = max_retries
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+        self._lock = threading.Lock()
+        self._global = TokenBucket(rate, burst)
+        self._endpoints: Dict[str, TokenBucket] = {}
+        self._blocked_until = 0.0
+
+    def _endpoint(self, method: str, url: str) -> str:
+        if self.endpoint_index is not None:
+            name = self.endpoint_index.find_url(method, url)
+            if name is not None:
+                return name
+        return f"{method} {urlsplit(url).path}"
+
+    def _reserve(self, method: str, url: str) -> float:
+        endpoint = self._endpoint(method, url)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._endpoints.get(endpoint)
+            if bucket is None:
+                rate, burst = self.endpoint_limits.get(
+                    endpoint, (self.endpoint_rate, self.endpoint_burst)
+                )
+                bucket = self._endpoints[endpoint] = TokenBucket(rate, burst)
+            return now + max(self._global.reserve(now), bucket.reserve(now))
+
+    def _delay(self, ready_at: float) -> float:
+        with self._lock:
+            return max(ready_at, self._blocked_until) - time.monotonic()
+
+    def _enter(self) -> None:
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _leave(self, started: float) -> None:
+        with self._lock:
+            self.queue_depth -= 1
+            self.waited += time.monotonic() - started
+
+    def acquire(self, method: str, url: str) -> None:
+        ready_at = self._reserve(method, url)
+        delay = self._delay(ready_at)
+        if delay <= 0:
+            return
+        started = time.monotonic()
+        self._enter()
+        try:
+            # A 429 may push the deadline while we sleep
+            while delay > 0:
+                time.sleep(delay)
+                delay = self._delay(ready_at)
+        finally:
+            self._leave(started)
+
+    async def aacquire(self, method: str, url: str) -> None:
+        ready_at = self._reserve(method, url)
+        delay = self._delay(ready_at)
+        if delay <= 0:
+            return
+        started = time.monotonic()
+        self._enter()
+        try:
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self._delay(ready_at)
+        finally:
+            self._leave(started)
+
+    def throttle(self, retry_after: Optional[str]) -> None:
+        """Block every request after a 429 response."""
+        with self._lock:
+            self.throttled += 1
+            self._blocked_until = max(
+                self._blocked_until, time.monotonic() + parse_retry_after(retry_after)
+            )
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "throttled": self.throttled,
+                "waited": self.waited,
+            }
@@ -0,0 +1,147 @@
+from typing import Any, ClassVar, Dict, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+from langchain_core.pydantic_v1 import BaseModel
+from langchain_core.utils.json import parse_json_markdown
+
+from langchain_community.agent_toolkits.openapi.planner import (
+    RequestsGetToolWithParsing,
+    RequestsPostToolWithParsing,
+    RequestsPatchToolWithParsing,
+    RequestsPutToolWithParsing,
+    RequestsDeleteToolWithParsing
+)
+
+from http_client import AsyncRequestsWrapper
+from response_reducer import ResponseReducer
+
+
+def _get_text(output: Any) -> str:
+    if isinstance(output, BaseMessage):
+        output = output.content
+    return str(output).strip()
+
+
+class _RequestsToolMixin(BaseModel):
+    """Sync and async request + response parsing shared by the request tools.
+
+    The community tools only implement `_run`, and call `llm_chain.predict`
+    which `PROMPT | llm` runnables do not have.
+
+    With a `response_reducer` the response is shrunk by field projection
+    instead of an LLM call, unless `parse_with_llm` is set.
+    """
+
+    operation: ClassVar[str]
+
+    response_reducer: Optional[ResponseReducer] = None
+    """Schema-driven reducer used instead of the LLM chain."""
+    parse_with_llm: bool = False
+    """Parse responses with `llm_chain` even when a reducer is set."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _reduce(
+        self, response: str, data: Dict[str, Any], status_code: Optional[int]
+    ) -> Optional[str]:
+        if self.response_reducer is None or self.parse_with_llm:
+            return None
+        return self.response_reducer.reduce(
+            self.operation, data["url"], response, self.response_length, status_code
+        )
+
+    def _request_kwargs(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if self.operation == "GET":
+            return {"params": data.get("params")}
+        if self.operation == "DELETE":
+            return {}
+        return {"json": data["data"]}
+
+    def _send(self, data: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+        wrapper = self.requests_wrapper
+        if isinstance(wrapper, AsyncRequestsWrapper):
+            # Keep the status, error bodies are not reduced
+            response = wrapper.request(
+                self.operation, data["url"], **self._request_kwargs(data)
+            )
+            return response.text, response.status_code
+        if self.operation == "GET":
+            return wrapper.get(data["url"], params=data.get("params")), None
+        if self.operation == "DELETE":
+            return wrapper.delete(data["url"]), None
+        return getattr(wrapper, self.operation.lower())(data["url"], data["data"]), None
+
+    async def _asend(self, data: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+        wrapper = self.requests_wrapper
+        if isinstance(wrapper, AsyncRequestsWrapper):
+            response = await wrapper.arequest(
+                self.operation, data["url"], **self._request_kwargs(data)
+            )
+            return response.text, response.status_code
+        if self.operation == "GET":
+            return await wrapper.aget(data["url"], params=data.get("params")), None
+        if self.operation == "DELETE":
+            return await wrapper.adelete(data["url"]), None
+        return (
+            await getattr(wrapper, f"a{self.operation.lower()}")(data["url"], data["data"]),
+            None,
+        )
+
+    def _parse(
+        self, response: str, data: Dict[str, Any], status_code: Optional[int] = None
+    ) -> str:
+        reduced = self._reduce(response, data, status_code)
+        if reduced is not None:
+            return reduced
+        inputs = {
+            "response": response[: self.response_length],
+            "instructions": data["output_instructions"],
+        }
+        if hasattr(self.llm_chain, "predict"):
+            return self.llm_chain.predict(**inputs).strip()
+        return _get_text(self.llm_chain.invoke(inputs))
+
+    async def _aparse(
+        self, response: str, data: Dict[str, Any], status_code: Optional[int] = None
+    ) -> str:
+        reduced = self._reduce(response, data, status_code)
+        if reduced is not None:
+            return reduced
+        inputs = {
+            "response": response[: self.response_length],
+            "instructions": data["output_instructions"],
+        }
+        if hasattr(self.llm_chain, "apredict"):
+            return (await self.llm_chain.apredict(**inputs)).strip()
+        return _get_text(await self.llm_chain.ainvoke(inputs))
+
+    def _run(self, text: str) -> str:
+        data = parse_json_markdown(text)
+        response, status_code = self._send(data)
+        return self._parse(response, data, status_code)
+
+    async def _arun(self, text: str) -> str:
+        data = parse_json_markdown(text)
+        response, status_code = await self._asend(data)
+        return await self._aparse(response, data, status_code)
+
+
+class RequestsGetTool(_RequestsToolMixin, RequestsGetToolWithParsing):
+    operation: ClassVar[str] = "GET"
+
+
+class RequestsPostTool(_RequestsToolMixin, RequestsPostToolWithParsing):
+    operation: ClassVar[str] = "POST"
+
+
+class RequestsPatchTool(_RequestsToolMixin, RequestsPatchToolWithParsing):
+    operation: ClassVar[str] = "PATCH"
+
+
+class RequestsPutTool(_RequestsToolMixin, RequestsPutToolWithParsing):
+    operation: ClassVar[str] = "PUT"
+
+
+class RequestsDeleteTool(_RequestsToolMixin, RequestsDeleteToolWithParsing):
+    operation: ClassVar[str] = "DELETE"
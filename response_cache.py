@@ -0,0 +1,134 @@
+import hashlib
+import threading
+import time
+import httpx
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+CacheKey = Tuple[str, str, str, Tuple[Tuple[str, str], ...]]
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    status_code: int
+    headers: Dict[str, str]
+    content: bytes
+    etag: Optional[str]
+    stored_at: float = field(default_factory=time.monotonic)
+
+    def to_response(self) -> httpx.Response:
+        return httpx.Response(
+            self.status_code,
+            headers=self.headers,
+            content=self.content,
+            request=httpx.Request("GET", self.url),
+        )
+
+
+def _resource_prefix(path: str, depth: int) -> str:
+    # /playlists/{id}/tracks -> /playlists/{id}
+    return "/" + "/".join(path.strip("/").split("/")[:depth])
+
+
+class ResponseCache:
+    """LRU + TTL cache of successful GET responses.
+
+    Entries are keyed by user (a hash of the Authorization header), host, path
+    and query. Expired entries that carry an ETag are revalidated with
+    `If-None-Match` instead of being downloaded again. A successful POST, PUT,
+    PATCH or DELETE drops every entry under the same resource prefix, the first
+    `prefix_depth` path segments.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 60.0, prefix_depth: int = 2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prefix_depth = prefix_depth
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+
+    def key(
+        self,
+        url: str,
+        params: Optional[Mapping[str, Any]],
+        headers: Optional[Mapping[str, str]],
+    ) -> CacheKey:
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        if params:
+            query.extend((str(name), str(value)) for name, value in params.items())
+        authorization = (headers or {}).get("Authorization", "")
+        user = hashlib.sha256(authorization.encode()).hexdigest()[:16]
+        return user, parts.netloc, parts.path.rstrip("/"), tuple(sorted(query))
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.stored_at < self.ttl
+
+    def revalidation_headers(self, entry: Optional[CacheEntry]) -> Dict[str, str]:
+        if entry is None or entry.etag is None:
+            return {}
+        return {"If-None-Match": entry.etag}
+
+    def update(
+        self, key: CacheKey, entry: Optional[CacheEntry], response: httpx.Response
+    ) -> httpx.Response:
+        """Store a fresh response, or turn a 304 into the cached response."""
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.revalidations += 1
+                entry.stored_at = time.monotonic()
+            return entry.to_response()
+
+        with self._lock:
+            self.misses += 1
+            if response.status_code != 200:
+                self._entries.pop(key, None)
+                return response
+            self._entries[key] = CacheEntry(
+                url=str(response.request.url),
+                status_code=response.status_code,
+                # content is stored decoded
+                headers={
+                    name: value
+                    for name, value in response.headers.items()
+                    if name not in ("content-encoding", "content-length")
+                },
+                content=response.content,
+                etag=response.headers.get("ETag"),
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return response
+
+    def hit(self, entry: CacheEntry) -> httpx.Response:
+        with self._lock:
+            self.hits += 1
+        return entry.to_response()
+
+    def invalidate(self, url: str) -> None:
+        parts = urlsplit(url)
+        prefix = _resource_prefix(parts.path, self.prefix_depth)
+        with self._lock:
+            for key in [
+                key
+                for key in self._entries
+                if key[1] == parts.netloc
+                and _resource_prefix(key[2], self.prefix_depth) == prefix
+            ]:
+                del self._entries[key]
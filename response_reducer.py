@@ -0,0 +1,185 @@
+import json
+import re
+
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Union
+
+if TYPE_CHECKING:
+    from prepare import EndpointIndex
+
+# Projection tree: True keeps the value as is, "[*]" projects every array item
+Shape = Union[bool, Dict[str, "Shape"]]
+
+# Fields that are large and rarely useful to the agent
+DEFAULT_EXCLUDED_FIELDS = frozenset(
+    {
+        "available_markets",
+        "copyrights",
+        "external_ids",
+        "external_urls",
+        "href",
+        "html_description",
+        "images",
+        "linked_from",
+        "preview_url",
+        "previous",
+        "restrictions",
+    }
+)
+
+_JSON_PATH_PATTERN = re.compile(r"\.(\w+)|\[\*\]")
+
+
+def _merge(left: Shape, right: Shape) -> Shape:
+    if left is True or right is True:
+        return True
+    merged = dict(left)
+    for key, value in right.items():
+        merged[key] = _merge(merged[key], value) if key in merged else value
+    return merged
+
+
+def _shape_from_schema(
+    schema: Dict[str, Any], excluded: Iterable[str], depth: int, max_depth: int
+) -> Optional[Shape]:
+    if depth > max_depth:
+        return None
+
+    shape: Optional[Shape] = None
+    for key in ("allOf", "oneOf", "anyOf"):
+        for sub_schema in schema.get(key, ()):
+            sub_shape = _shape_from_schema(sub_schema, excluded, depth, max_depth)
+            if sub_shape is not None:
+                shape = sub_shape if shape is None else _merge(shape, sub_shape)
+
+    if schema.get("type") == "array" or "items" in schema:
+        items = _shape_from_schema(schema.get("items", {}), excluded, depth + 1, max_depth)
+        return None if items is None else {"[*]": items}
+
+    properties = {}
+    for name, property_schema in schema.get("properties", {}).items():
+        if name in excluded:
+            continue
+        property_shape = _shape_from_schema(property_schema, excluded, depth + 1, max_depth)
+        if property_shape is not None:
+            properties[name] = property_shape
+    if properties:
+        shape = properties if shape is None else _merge(shape, properties)
+
+    if shape is None and "properties" not in schema and "allOf" not in schema:
+        # Scalars and free-form objects are kept, and truncated
+        return True
+    return shape
+
+
+def _shape_from_paths(paths: Iterable[str]) -> Shape:
+    shape: Shape = {}
+    for path in paths:
+        steps = [
+            "[*]" if match.group(0) == "[*]" else match.group(1)
+            for match in _JSON_PATH_PATTERN.finditer(path)
+        ]
+        node: Shape = True
+        for step in reversed(steps):
+            node = {step: node}
+        shape = _merge(shape, node)
+    return shape
+
+
+def _paths_from_shape(shape: Shape, prefix: str = "$") -> List[str]:
+    if shape is True:
+        return [prefix]
+    paths = []
+    for key, value in shape.items():
+        paths.extend(
+            _paths_from_shape(value, prefix + ("[*]" if key == "[*]" else f".{key}"))
+        )
+    return paths
+
+
+class ResponseReducer:
+    """Shrinks JSON responses without an LLM call.
+
+    Each endpoint's 200 response schema from the reduced spec is turned into a
+    JSONPath-style projection (e.g. `$.items[*].name`), which keeps scalar
+    fields up to `max_depth` levels deep. Arrays keep `max_items` items and
+    strings `max_string_length` characters. `fields` overrides the projection
+    of an endpoint with explicit paths. Error responses, non-2xx statuses or
+    bodies with a top-level `error`, are kept as sent.
+    """
+
+    def __init__(
+        self,
+        endpoint_index: "EndpointIndex",
+        fields: Optional[Dict[str, List[str]]] = None,
+        excluded_fields: Iterable[str] = DEFAULT_EXCLUDED_FIELDS,
+        max_depth: int = 5,
+        max_items: int = 20,
+        max_string_length: int = 200,
+    ):
+        self.endpoint_index = endpoint_index
+        self.excluded_fields = frozenset(excluded_fields)
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_string_length = max_string_length
+        self._shapes: Dict[str, Shape] = {
+            name: _shape_from_paths(paths) for name, paths in (fields or {}).items()
+        }
+
+    def _get_shape(self, method: str, url: str) -> Shape:
+        name = self.endpoint_index.find_url(method, url)
+        if name is None:
+            return True
+
+        shape = self._shapes.get(name)
+        if shape is None:
+            schema = self.endpoint_index.response_schema(name)
+            if schema:
+                shape = _shape_from_schema(
+                    schema, self.excluded_fields, 0, self.max_depth
+                )
+            shape = self._shapes[name] = True if shape is None else shape
+        return shape
+
+    def projection(self, method: str, url: str) -> List[str]:
+        """Return the JSONPath projection used for a request."""
+        return _paths_from_shape(self._get_shape(method, url))
+
+    def _project(self, data: Any, shape: Shape) -> Any:
+        if isinstance(data, list):
+            if isinstance(shape, dict) and "[*]" in shape:
+                shape = shape["[*]"]
+            items = [self._project(item, shape) for item in data[: self.max_items]]
+            if len(data) > self.max_items:
+                items.append(f"... {len(data) - self.max_items} more")
+            return items
+        if isinstance(data, dict):
+            if shape is True or "[*]" in shape:
+                return {key: self._project(value, True) for key, value in data.items()}
+            return {
+                key: self._project(data[key], sub_shape)
+                for key, sub_shape in shape.items()
+                if data.get(key) is not None
+            }
+        if isinstance(data, str) and len(data) > self.max_string_length:
+            return data[: self.max_string_length] + "..."
+        return data
+
+    def reduce(
+        self,
+        method: str,
+        url: str,
+        response: str,
+        max_length: int,
+        status_code: Optional[int] = None,
+    ) -> str:
+        if status_code is not None and not 200 <= status_code < 300:
+            return response[:max_length]
+        try:
+            data = json.loads(response)
+        except ValueError:
+            return response[:max_length]
+        if isinstance(data, dict) and "error" in data:
+            # e.g. {"error": {"status": 401, ...}}, the 200 schema would drop it
+            return response[:max_length]
+        reduced = self._project(data, self._get_shape(method, url))
+        return json.dumps(reduced, ensure_ascii=False, separators=(",", ":"))[:max_length]
@@ -0,0 +1,608 @@
+import asyncio
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Set,
+    Tuple,
+    Union,
+)
+
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+from langchain_core.messages import BaseMessage, FunctionMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from typing_extensions import NotRequired, TypedDict
+
+from observation_store import ObservationStore, is_typed, to_content
+from output_parser import ID_PATTERN, Task
+
+# Custom event carrying the ScheduleStats of each schedule_tasks run
+SCHEDULE_STATS_EVENT = "schedule_stats"
+# Seconds ready tasks of batched tools wait for more of them to be planned
+BATCH_WINDOW = 0.05
+
+
+class SchedulerInput(TypedDict):
+    messages: List[BaseMessage]
+    tasks: Union[Iterable[Task], AsyncIterable[Task]]
+    # Set it to stop the run, e.g. to replan, finished tasks are still returned
+    cancel: NotRequired[threading.Event]
+    # Results of the earlier plans of the question, else read from `messages`
+    store: NotRequired[ObservationStore]
+
+
+# Helper functions
+
+
+_ID_REGEX = re.compile(ID_PATTERN)
+
+
+def _resolve_arg(
+    arg: Union[str, Any], observations: Mapping[int, Any], typed: bool = False
+):
+    def replace_match(match):
+        # If the string is ${123}, match.group(0) is ${123}, and match.group(1) is 123.
+
+        # Return the match group, in this case the index, from the string. This is the index
+        # number we get back.
+        idx = int(match.group(1))
+        if idx not in observations:
+            return match.group(0)
+        observation = observations[idx]
+        # repr keeps every digit of a float
+        return repr(observation) if isinstance(observation, float) else to_content(observation)
+
+    # For dependencies on other tasks
+    if isinstance(arg, str):
+        # An argument that is only a reference gets the typed value itself,
+        # when the tool's field takes more than text
+        match = _ID_REGEX.fullmatch(arg.strip())
+        if typed and match is not None and is_typed(observations.get(int(match.group(1)))):
+            return observations[int(match.group(1))]
+        return _ID_REGEX.sub(replace_match, arg)
+    elif isinstance(arg, list):
+        return [_resolve_arg(a, observations, typed) for a in arg]
+    else:
+        return str(arg)
+
+
+def _typed_fields(tool: Any) -> Set[str]:
+    """Arguments of a tool whose values, or list items, need not be text."""
+    fields = getattr(getattr(tool, "args_schema", None), "__fields__", {})
+    return {name for name, field in fields.items() if field.type_ is not str}
+
+
+def _resolve_args(task: Task, observations: Mapping[int, Any]):
+    args = task["args"]
+    if isinstance(args, str):
+        return _resolve_arg(args, observations)
+    elif isinstance(args, dict):
+        typed_fields = _typed_fields(task["tool"])
+        return {
+            key: _resolve_arg(val, observations, key in typed_fields)
+            for key, val in args.items()
+        }
+    else:
+        # This will likely fail
+        return args
+
+
+def _execute_task(task: Task, observations: Mapping[int, Any], config: RunnableConfig):
+    tool_to_use = task["tool"]
+    if isinstance(tool_to_use, str):
+        return tool_to_use
+    args = task["args"]
+    try:
+        resolved_args = _resolve_args(task, observations)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}.)"
+            f" Args could not be resolved. Error: {repr(e)}"
+        )
+    try:
+        return tool_to_use.invoke(resolved_args, config)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}."
+            + f" Args resolved to {resolved_args}. Error: {repr(e)})"
+        )
+
+
+async def _aexecute_task(
+    task: Task, observations: Mapping[int, Any], config: RunnableConfig
+):
+    tool_to_use = task["tool"]
+    if isinstance(tool_to_use, str):
+        return tool_to_use
+    args = task["args"]
+    try:
+        resolved_args = _resolve_args(task, observations)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}.)"
+            f" Args could not be resolved. Error: {repr(e)}"
+        )
+    try:
+        return await tool_to_use.ainvoke(resolved_args, config)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}."
+            + f" Args resolved to {resolved_args}. Error: {repr(e)})"
+        )
+
+
+def _execute_batch(
+    tasks: List[Task], observations: Mapping[int, Any], config: RunnableConfig
+) -> List[Any]:
+    """Run tasks of the same batched tool with one `batch` call."""
+    if len(tasks) == 1:
+        return [_execute_task(tasks[0], observations, config)]
+    tool_to_use = tasks[0]["tool"]
+    try:
+        resolved_args = [_resolve_args(task, observations) for task in tasks]
+    except Exception:
+        # Let each task report its own error
+        return [_execute_task(task, observations, config) for task in tasks]
+    try:
+        return tool_to_use.batch(resolved_args, config)
+    except Exception as e:
+        return [
+            f"ERROR(Failed to call {tool_to_use.name} with args {task['args']}."
+            + f" Args resolved to {args}. Error: {repr(e)})"
+            for task, args in zip(tasks, resolved_args)
+        ]
+
+
+async def _aexecute_batch(
+    tasks: List[Task], observations: Mapping[int, Any], config: RunnableConfig
+) -> List[Any]:
+    if len(tasks) == 1:
+        return [await _aexecute_task(tasks[0], observations, config)]
+    tool_to_use = tasks[0]["tool"]
+    try:
+        resolved_args = [_resolve_args(task, observations) for task in tasks]
+    except Exception:
+        return [await _aexecute_task(task, observations, config) for task in tasks]
+    try:
+        return await tool_to_use.abatch(resolved_args, config)
+    except Exception as e:
+        return [
+            f"ERROR(Failed to call {tool_to_use.name} with args {task['args']}."
+            + f" Args resolved to {args}. Error: {repr(e)})"
+            for task, args in zip(tasks, resolved_args)
+        ]
+
+
+def _is_batched(task: Task) -> bool:
+    return getattr(task["tool"], "batched", False)
+
+
+def _group_batches(ready: List[Task]) -> List[List[Task]]:
+    """Group ready tasks into runs, one per task except for batched tools.
+
+    All the ready tasks of a tool with `batched` set (e.g. `math`) go to the
+    tool in one `batch` call.
+    """
+    groups: List[List[Task]] = []
+    batches: Dict[str, List[Task]] = {}
+    for task in ready:
+        if _is_batched(task):
+            batch = batches.get(task["tool"].name)
+            if batch is None:
+                batch = batches[task["tool"].name] = []
+                groups.append(batch)
+            batch.append(task)
+        else:
+            groups.append([task])
+    return groups
+
+
+class _HeldBatch:
+    """Ready tasks of batched tools, held so consecutive ones run as one batch.
+
+    They are started with the next task of the plan, or `window` seconds after
+    the first of them was held if the planner stalls in between.
+    """
+
+    def __init__(
+        self,
+        start: Callable[[List[Task]], None],
+        call_later: Callable[[float, Callable[[], None]], Any],
+        window: float = BATCH_WINDOW,
+    ):
+        self._start = start
+        self._call_later = call_later
+        self.window = window
+        self._lock = threading.Lock()
+        self._tasks: List[Task] = []
+        self._timer = None
+
+    def hold(self, ready: List[Task]) -> None:
+        with self._lock:
+            self._tasks.extend(ready)
+            if self._timer is None:
+                self._timer = self._call_later(self.window, self.flush)
+
+    def flush(self, ready: Iterable[Task] = ()) -> None:
+        """Start the held tasks, along with `ready`."""
+        with self._lock:
+            tasks, self._tasks = self._tasks + list(ready), []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self._start(tasks)
+
+
+def _call_later(delay: float, callback: Callable[[], None]) -> threading.Timer:
+    timer = threading.Timer(delay, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class DependencyTracker:
+    """Counts the unfinished dependencies of every waiting task.
+
+    `add` and `complete` return the tasks that became ready, so dependents are
+    started as soon as their last dependency finishes instead of being polled.
+    """
+
+    def __init__(self, observations: ObservationStore):
+        self.observations = observations
+        self._lock = threading.Lock()
+        self._planned: Set[int] = set()
+        self._unmet: Dict[int, int] = {}
+        self._waiting: Dict[int, Task] = {}
+        self._dependents: Dict[int, List[Task]] = defaultdict(list)
+
+    @property
+    def pending(self) -> int:
+        return len(self._waiting)
+
+    def add(self, task: Task) -> List[Task]:
+        with self._lock:
+            self._planned.add(task["idx"])
+            unmet = {
+                dep for dep in task["dependencies"] if dep not in self.observations
+            }
+            if not unmet:
+                return [task]
+            self._unmet[task["idx"]] = len(unmet)
+            self._waiting[task["idx"]] = task
+            for dep in unmet:
+                self._dependents[dep].append(task)
+            return []
+
+    def complete(self, idx: int, observation: Any) -> List[Task]:
+        with self._lock:
+            self.observations[idx] = observation
+            return self._release(idx)
+
+    def finish_planning(self) -> List[Task]:
+        """Release tasks waiting on indices the plan never produced."""
+        with self._lock:
+            ready = []
+            for dep in list(self._dependents):
+                if dep not in self._planned:
+                    ready.extend(self._release(dep))
+            return ready
+
+    def unblock_all(self) -> List[Task]:
+        """Release every waiting task, e.g. when their dependencies are cyclic."""
+        with self._lock:
+            ready = list(self._waiting.values())
+            self._waiting.clear()
+            self._unmet.clear()
+            self._dependents.clear()
+            return ready
+
+    def _release(self, dep: int) -> List[Task]:
+        ready = []
+        for task in self._dependents.pop(dep, ()):
+            if task["idx"] not in self._waiting:
+                continue
+            self._unmet[task["idx"]] -= 1
+            if self._unmet[task["idx"]] == 0:
+                del self._unmet[task["idx"]]
+                ready.append(self._waiting.pop(task["idx"]))
+        return ready
+
+
+@dataclass
+class ScheduleStats:
+    """Where the time of a schedule_tasks run went, in seconds.
+
+    `planning` is the time spent waiting on the plan stream, `tools` the time
+    at least one tool was running, and `overlap` the part of both that ran at
+    the same time: tool time hidden behind plan generation.
+    """
+
+    wall: float
+    planning: float
+    tools: float
+    overlap: float
+    tasks: int
+    cancelled: bool
+
+
+def _intersection(left: List[Tuple[float, float]], right: List[Tuple[float, float]]) -> float:
+    # Both lists are sorted and their intervals do not overlap
+    total, i, j = 0.0, 0, 0
+    while i < len(left) and j < len(right):
+        total += max(0.0, min(left[i][1], right[j][1]) - max(left[i][0], right[j][0]))
+        if left[i][1] < right[j][1]:
+            i += 1
+        else:
+            j += 1
+    return total
+
+
+class _Timeline:
+    """Records when the plan stream was awaited and when tools were running."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.planning: List[Tuple[float, float]] = []
+        self.tools: List[Tuple[float, float]] = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._busy_since = 0.0
+
+    def tool_started(self, count: int = 1) -> None:
+        with self._lock:
+            if self._running == 0:
+                self._busy_since = time.perf_counter()
+            self._running += count
+
+    def tool_finished(self, count: int = 1) -> None:
+        with self._lock:
+            self._running -= count
+            if self._running == 0:
+                self.tools.append((self._busy_since, time.perf_counter()))
+
+    def iterate(self, plan: Iterable[Task]) -> Iterator[Task]:
+        iterator = iter(plan)
+        while True:
+            started = time.perf_counter()
+            try:
+                task = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.planning.append((started, time.perf_counter()))
+            yield task
+
+    async def aiterate(
+        self, plan: Union[Iterable[Task], AsyncIterable[Task]]
+    ) -> AsyncIterator[Task]:
+        if isinstance(plan, AsyncIterable):
+            iterator = plan.__aiter__()
+            pull = iterator.__anext__
+        else:
+            # A sync stream is read in a thread so tools keep running meanwhile
+            sync_iterator = iter(plan)
+
+            def pull():
+                return asyncio.to_thread(next, sync_iterator, None)
+        while True:
+            started = time.perf_counter()
+            try:
+                task = await pull()
+            except StopAsyncIteration:
+                return
+            finally:
+                self.planning.append((started, time.perf_counter()))
+            if task is None:
+                return
+            yield task
+
+    def stats(self, tasks: int, cancelled: bool) -> ScheduleStats:
+        with self._lock:
+            tools = list(self.tools)
+            if self._running:
+                tools.append((self._busy_since, time.perf_counter()))
+        return ScheduleStats(
+            wall=time.perf_counter() - self.started,
+            planning=sum(end - start for start, end in self.planning),
+            tools=sum(end - start for start, end in tools),
+            overlap=_intersection(self.planning, tools),
+            tasks=tasks,
+            cancelled=cancelled,
+        )
+
+
+def _get_task_name(task: Task) -> str:
+    return task["tool"] if isinstance(task["tool"], str) else task["tool"].name
+
+
+def _to_tool_messages(
+    observations: ObservationStore,
+    originals: Set[int],
+    tasks: Dict[int, Task],
+) -> List[FunctionMessage]:
+    # Convert observations to new tool messages to add to the state
+    return [
+        observations.message(k, _get_task_name(tasks[k]), tasks[k]["args"])
+        for k in sorted(set(observations) - originals)
+        if k in tasks
+    ]
+
+
+def _get_store(scheduler_input: SchedulerInput) -> ObservationStore:
+    store = scheduler_input.get("store")
+    if store is None:
+        # Without a store, read the results of earlier plans from the messages
+        store = ObservationStore.from_messages(scheduler_input["messages"])
+    return store
+
+
+def _schedule_tasks(
+    scheduler_input: SchedulerInput, config: RunnableConfig
+) -> List[FunctionMessage]:
+    """Group the tasks into a DAG schedule."""
+    # For streaming, we are making a simplifying assumption:
+    # The LLM does not create cyclic dependencies. If it does, the remaining
+    # tasks are run once nothing else is in flight.
+    cancel = scheduler_input.get("cancel") or threading.Event()
+    # If we are re-planning, we may have calls that depend on previous
+    # plans. Start with those.
+    observations = _get_store(scheduler_input)
+    originals = set(observations)
+    tracker = DependencyTracker(observations)
+    tasks: Dict[int, Task] = {}
+    timeline = _Timeline()
+
+    idle = threading.Condition()
+    in_flight = 0
+
+    # The plan stream is only read here, every tool runs in the executor
+    executor = ThreadPoolExecutor()
+
+    def start(ready: List[Task]):
+        nonlocal in_flight
+        if cancel.is_set():
+            return
+        with idle:
+            in_flight += len(ready)
+        for group in _group_batches(ready):
+            executor.submit(run, group)
+
+    def run(group: List[Task]):
+        nonlocal in_flight
+        timeline.tool_started(len(group))
+        try:
+            results = _execute_batch(group, observations, config)
+        except Exception as e:
+            results = [f"ERROR({repr(e)})"] * len(group)
+        finally:
+            timeline.tool_finished(len(group))
+        for task, observation in zip(group, results):
+            # Wake the dependents before this task stops counting as in flight
+            start(tracker.complete(task["idx"], observation))
+        with idle:
+            in_flight -= len(group)
+            idle.notify_all()
+
+    # Ready tasks of batched tools wait a little for the next task of the
+    # plan, so consecutive `math` tasks run as one batch
+    held = _HeldBatch(start, _call_later)
+
+    try:
+        for task in timeline.iterate(scheduler_input["tasks"]):
+            if cancel.is_set():
+                break
+            tasks[task["idx"]] = task
+            ready = tracker.add(task)
+            if ready and _is_batched(task):
+                held.hold(ready)
+                continue
+            # No deps or all deps satisfied
+            # can schedule now
+            held.flush(ready)
+        held.flush()
+
+        # All tasks have been submitted or enqueued
+        # Wait for them to complete
+        start(tracker.finish_planning())
+        with idle:
+            while (in_flight or tracker.pending) and not cancel.is_set():
+                if in_flight:
+                    # Wake up now and then to notice a cancellation
+                    idle.wait(0.1)
+                else:
+                    start(tracker.unblock_all())
+    except BaseException:
+        cancel.set()
+        raise
+    finally:
+        # Tasks not started yet are dropped, running ones finish unobserved
+        executor.shutdown(wait=False, cancel_futures=cancel.is_set())
+
+    tool_messages = _to_tool_messages(observations, originals, tasks)
+    dispatch_custom_event(
+        SCHEDULE_STATS_EVENT, timeline.stats(len(tasks), cancel.is_set()), config=config
+    )
+    return tool_messages
+
+
+async def _aschedule_tasks(
+    scheduler_input: SchedulerInput, config: RunnableConfig
+) -> List[FunctionMessage]:
+    """Group the tasks into a DAG schedule, running the tools on the event loop."""
+    cancel = scheduler_input.get("cancel") or threading.Event()
+    observations = _get_store(scheduler_input)
+    originals = set(observations)
+    tracker = DependencyTracker(observations)
+    tasks: Dict[int, Task] = {}
+    timeline = _Timeline()
+    in_flight: Set[asyncio.Task] = set()
+
+    async def run(group: List[Task]):
+        timeline.tool_started(len(group))
+        try:
+            results = await _aexecute_batch(group, observations, config)
+        except Exception as e:
+            results = [f"ERROR({repr(e)})"] * len(group)
+        finally:
+            timeline.tool_finished(len(group))
+        for task, observation in zip(group, results):
+            start(tracker.complete(task["idx"], observation))
+
+    def start(ready: List[Task]):
+        if cancel.is_set():
+            return
+        for group in _group_batches(ready):
+            in_flight.add(asyncio.create_task(run(group)))
+
+    # Ready tasks of batched tools wait a little for the next task of the plan
+    held = _HeldBatch(start, asyncio.get_running_loop().call_later)
+
+    try:
+        async for task in timeline.aiterate(scheduler_input["tasks"]):
+            if cancel.is_set():
+                break
+            tasks[task["idx"]] = task
+            ready = tracker.add(task)
+            if ready and _is_batched(task):
+                held.hold(ready)
+                continue
+            held.flush(ready)
+        held.flush()
+
+        start(tracker.finish_planning())
+        while (in_flight or tracker.pending) and not cancel.is_set():
+            if not in_flight:
+                start(tracker.unblock_all())
+                continue
+            done, _ = await asyncio.wait(
+                in_flight, timeout=0.1, return_when=asyncio.FIRST_COMPLETED
+            )
+            in_flight.difference_update(done)
+    except BaseException:
+        # Includes the run itself being cancelled
+        cancel.set()
+        raise
+    finally:
+        for running in in_flight:
+            running.cancel()
+
+    tool_messages = _to_tool_messages(observations, originals, tasks)
+    await adispatch_custom_event(
+        SCHEDULE_STATS_EVENT, timeline.stats(len(tasks), cancel.is_set()), config=config
+    )
+    return tool_messages
+
+
+schedule_tasks = RunnableLambda(_schedule_tasks, _aschedule_tasks, name="schedule_tasks")
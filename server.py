@@ -0,0 +1,203 @@
+"""ASGI entry point serving the plan-and-execute graph over websockets.
+
+Run it with any ASGI server, e.g. `uvicorn server:app`. The spec, LLM clients
+and tools are built once, when `openapi_plan_execute` is imported, and every
+session runs on the same event loop.
+
+Protocol: the client sends a command, as text or as `{"input": "..."}`. The
+server answers with `{"type": "thread", "thread_id": ...}`, then one
+`{"type": "event", "node": ..., "update": ...}` message per graph event, then
+`{"type": "end"}`. Failures are reported as `{"type": "error", "message": ...}`.
+A failed or interrupted run is continued by sending `{"resume": thread_id}`.
+
+The Spotify user is given by the `user` query parameter of the websocket URL,
+which the proxy in front of the server is expected to authenticate.
+A user without a token gets an error carrying an `authorize_url`; Spotify
+then redirects to `/callback`, which stores the token for the user the URL
+was issued to, found by its one-time `state` nonce.
+"""
+import asyncio
+import json
+import os
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import parse_qs
+
+from openapi_plan_execute import app as graph, requests_wrapper, run_config, token_manager
+from token_manager import current_user
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Sessions over the limit are refused so the load balancer retries elsewhere
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", "100"))
+# Events buffered per session before the graph run waits for the client
+SESSION_QUEUE_SIZE = int(os.environ.get("SESSION_QUEUE_SIZE", "16"))
+
+_END = object()
+
+
+class Session:
+    """One websocket connection, running at most one command at a time."""
+
+    def __init__(self, send: Send, user_id: str):
+        self.send = send
+        self.user_id = user_id
+        self.run: Optional[asyncio.Task] = None
+
+    async def _send_json(self, message: Dict[str, Any]) -> None:
+        await self.send(
+            {"type": "websocket.send", "text": json.dumps(message, default=str)}
+        )
+
+    async def _produce(
+        self, command: Optional[str], thread_id: Optional[str], queue: asyncio.Queue
+    ) -> None:
+        # Tasks and threads started by the graph inherit the user
+        current_user.set(self.user_id)
+        config = run_config(thread_id)
+        await queue.put({"type": "thread", "thread_id": config["configurable"]["thread_id"]})
+        # No input resumes the thread from its last checkpoint
+        inputs = None if command is None else {"input": command}
+        try:
+            async for event in graph.astream(inputs, config=config):
+                for node, update in event.items():
+                    if node != "__end__":
+                        # Blocks while the queue is full, which pauses the graph
+                        await queue.put({"type": "event", "node": node, "update": update})
+            await queue.put({"type": "end"})
+        except Exception as e:
+            await queue.put({"type": "error", "message": str(e)})
+        finally:
+            await queue.put(_END)
+
+    async def _execute(self, command: Optional[str], thread_id: Optional[str]) -> None:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SESSION_QUEUE_SIZE)
+        producer = asyncio.create_task(self._produce(command, thread_id, queue))
+        try:
+            while True:
+                message = await queue.get()
+                if message is _END:
+                    break
+                await self._send_json(message)
+        finally:
+            producer.cancel()
+
+    async def handle(self, text: str) -> None:
+        if self.run is not None and not self.run.done():
+            await self._send_json(
+                {"type": "error", "message": "A command is already running"}
+            )
+            return
+        if token_manager.store.get(self.user_id) is None:
+            await self._send_json(
+                {
+                    "type": "error",
+                    "message": "Authorization required",
+                    "authorize_url": token_manager.authorize_url(self.user_id),
+                }
+            )
+            return
+        command, thread_id = text, None
+        try:
+            message = json.loads(text)
+            if "resume" in message:
+                command, thread_id = None, str(message["resume"])
+            else:
+                command = message["input"]
+        except (ValueError, TypeError, KeyError):
+            pass
+        self.run = asyncio.create_task(self._execute(command, thread_id))
+
+    async def close(self) -> None:
+        if self.run is not None:
+            self.run.cancel()
+            await asyncio.gather(self.run, return_exceptions=True)
+
+
+class Server:
+    def __init__(self, max_sessions: int = MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "websocket":
+            await self.websocket(scope, receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, send)
+        elif scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+
+    async def websocket(self, scope: Scope, receive: Receive, send: Send) -> None:
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        if self.sessions >= self.max_sessions:
+            # 1013: try again later
+            await send({"type": "websocket.close", "code": 1013})
+            return
+
+        self.sessions += 1
+        query = parse_qs(scope.get("query_string", b"").decode())
+        session = Session(send, query.get("user", ["default"])[0])
+        try:
+            await send({"type": "websocket.accept"})
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None and message.get("bytes") is not None:
+                    text = message["bytes"].decode()
+                if text:
+                    await session.handle(text)
+        finally:
+            self.sessions -= 1
+            await session.close()
+
+    async def http(self, scope: Scope, send: Send) -> None:
+        query = parse_qs(scope.get("query_string", b"").decode())
+        if scope["path"] == "/health":
+            status, body = 200, {"status": "ok", "sessions": self.sessions}
+            if requests_wrapper.rate_limiter is not None:
+                body["rate_limiter"] = requests_wrapper.rate_limiter.stats()
+        elif scope["path"] == "/callback" and "code" in query and "state" in query:
+            # Only states issued by authorize_url are accepted, once
+            user_id = token_manager.user_for_state(query["state"][0])
+            if user_id is None:
+                status, body = 400, {"error": "Unknown or expired authorization state"}
+            else:
+                try:
+                    await asyncio.to_thread(
+                        token_manager.complete_authorization, user_id, query["code"][0]
+                    )
+                    status, body = 200, {"status": "authorized"}
+                except Exception as e:
+                    # e.g. an invalid or expired code
+                    status, body = 400, {"error": f"Authorization failed: {e}"}
+        else:
+            status, body = 404, {"error": "Not found"}
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+    async def lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                token_manager.stop()
+                await requests_wrapper.aclose()
+                requests_wrapper.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = Server()
@@ -0,0 +1,171 @@
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import yaml
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, overload
+
+from langchain_community.agent_toolkits.openapi.spec import (
+    ReducedOpenAPISpec,
+    reduce_openapi_spec,
+)
+
+CACHE_DIR = ".spec_cache"
+# Bump when the cache layout or the reduced spec format changes
+_CACHE_VERSION = 1
+_HEADER_SIZE = struct.Struct("<Q")
+
+Endpoint = Tuple[str, Optional[str], Dict[str, Any]]
+
+
+@dataclass
+class CachedSpec:
+    """A reduced spec loaded from the cache and what is needed to authorize against it."""
+
+    api_spec: ReducedOpenAPISpec
+    scopes: List[str]
+    spec_hash: str
+
+
+class LazyEndpoints(Sequence[Endpoint]):
+    """Read-only view of the cached endpoints.
+
+    Names and descriptions are kept in memory, the docs of an endpoint are only
+    unpickled from the memory-mapped cache file when that endpoint is accessed.
+    """
+
+    def __init__(
+        self,
+        buffer: mmap.mmap,
+        data_offset: int,
+        entries: List[Tuple[str, Optional[str], int, int]],
+    ):
+        self._buffer = buffer
+        self._data_offset = data_offset
+        self._entries = entries
+        self.names = [name for name, _, _, _ in entries]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @overload
+    def __getitem__(self, index: int) -> Endpoint: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Endpoint]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        name, description, _, _ = self._entries[index]
+        return name, description, self.docs(index)
+
+    def __iter__(self) -> Iterator[Endpoint]:
+        for i in range(len(self._entries)):
+            yield self[i]
+
+    def docs(self, index: int) -> Dict[str, Any]:
+        _, _, offset, length = self._entries[index]
+        start = self._data_offset + offset
+        return pickle.loads(self._buffer[start:start + length])
+
+
+def _get_scopes(raw_spec: dict) -> List[str]:
+    security_schemes = raw_spec.get("components", {}).get("securitySchemes", {})
+    scopes: List[str] = []
+    for scheme in security_schemes.values():
+        for flow in scheme.get("flows", {}).values():
+            scopes.extend(
+                scope for scope in flow.get("scopes", {}) if scope not in scopes
+            )
+    return scopes
+
+
+def _write_cache(cache_path: str, raw_spec: dict) -> None:
+    api_spec = reduce_openapi_spec(raw_spec)
+
+    entries = []
+    blobs = []
+    offset = 0
+    for name, description, docs in api_spec.endpoints:
+        blob = pickle.dumps(docs, protocol=pickle.HIGHEST_PROTOCOL)
+        entries.append((name, description, offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = pickle.dumps(
+        {
+            "servers": api_spec.servers,
+            "description": api_spec.description,
+            "scopes": _get_scopes(raw_spec),
+            "entries": entries,
+        },
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+
+    # Write next to the target and rename, so concurrent workers never see a
+    # partially written cache
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(_HEADER_SIZE.pack(len(header)))
+            file.write(header)
+            for blob in blobs:
+                file.write(blob)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _remove_stale_caches(cache_dir: str, stem: str, keep: str) -> None:
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith(f"{stem}.") and file_name.endswith(".bin"):
+            path = os.path.join(cache_dir, file_name)
+            if path != keep:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+def load_spec(spec_path: str, cache_dir: str = CACHE_DIR) -> CachedSpec:
+    """Load a reduced OpenAPI spec, parsing the YAML only when it changed.
+
+    The reduced spec is stored in `cache_dir` under the hash of the YAML file
+    contents, so editing the spec invalidates the cache.
+    """
+    with open(spec_path, "rb") as file:
+        content = file.read()
+    spec_hash = hashlib.sha256(content).hexdigest()
+
+    stem = os.path.splitext(os.path.basename(spec_path))[0]
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(
+        cache_dir, f"{stem}.{spec_hash[:16]}.v{_CACHE_VERSION}.bin"
+    )
+
+    if not os.path.exists(cache_path):
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        raw_spec = yaml.load(content, Loader=loader)
+        del content
+        _write_cache(cache_path, raw_spec)
+        _remove_stale_caches(cache_dir, stem, keep=cache_path)
+
+    with open(cache_path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (header_size,) = _HEADER_SIZE.unpack_from(buffer, 0)
+    data_offset = _HEADER_SIZE.size + header_size
+    header = pickle.loads(buffer[_HEADER_SIZE.size:data_offset])
+
+    api_spec = ReducedOpenAPISpec(
+        servers=header["servers"],
+        description=header["description"],
+        endpoints=LazyEndpoints(buffer, data_offset, header["entries"]),
+    )
+    return CachedSpec(api_spec=api_spec, scopes=header["scopes"], spec_hash=spec_hash)
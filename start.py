@@ -3,17 +3,16 @@ import os
 # import tiktoken
 import asyncio
 import dotenv
-import yaml
 
-import spotipy.util as util
-
-from langchain_community.agent_toolkits.openapi.spec import reduce_openapi_spec
 from langchain_community.agent_toolkits.openapi import planner
 
-from langchain_community.utilities.requests import RequestsWrapper
 
 from langchain_groq import ChatGroq
 
+from http_client import AsyncRequestsWrapper
+from spec_loader import load_spec
+from token_manager import EncryptedTokenStore, TokenManager
+
 
 dotenv.load_dotenv(dotenv.find_dotenv(filename=".env"))
 
@@ -23,24 +22,14 @@ os.environ["LANGCHAIN_PROJECT"] = "Plan-and-execute"
 # with open("spotify_openapi.yaml") as f:
 #     raw_spotify_api_spec = yaml.load(f, Loader=yaml.Loader)
 
-with open("spotify_openapi.yaml", "r", encoding="utf-8") as file:
-    raw_spotify_api_spec = yaml.safe_load(file)
-spotify_api_spec = reduce_openapi_spec(raw_spotify_api_spec)
-
+spotify_spec = load_spec("spotify_openapi.yaml")
+spotify_api_spec = spotify_spec.api_spec
 
-def construct_spotify_auth_headers(raw_spec: dict):
-    scopes = list(
-        raw_spec["components"]["securitySchemes"]["oauth_2_0"]["flows"][
-            "authorizationCode"
-        ]["scopes"].keys()
-    )
-    access_token = util.prompt_for_user_token(scope=",".join(scopes))
-    return {"Authorization": f"Bearer {access_token}"}
 
-
-# Get API credentials.
-headers = construct_spotify_auth_headers(raw_spotify_api_spec)
-requests_wrapper = RequestsWrapper(headers=headers)
+# Tokens are kept per user and refreshed in the background before they expire
+token_manager = TokenManager(spotify_spec.scopes, EncryptedTokenStore())
+token_manager.start()
+requests_wrapper = AsyncRequestsWrapper(header_provider=token_manager.headers)
 
 # llm = ChatGroq(model_name="gemma2-9b-it", temperature=0.0)
 llm = ChatGroq(model_name="llama-3.1-70b-versatile", temperature=0.0)
@@ -60,6 +49,9 @@ spotify_agent = planner.create_openapi_agent(
 
 
 async def main():
+    # Asks for authorization in the browser only when no token is stored yet
+    token_manager.authorize()
+
     while True:
         user_query = input("Command: ")
         agent_result = await spotify_agent.ainvoke(user_query)
@@ -0,0 +1,55 @@
+import asyncio
+import contextvars
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import tool
+
+from api_controller_agent import TOOL_RESULT_EVENT, ConcurrentToolNode
+
+user = contextvars.ContextVar("user", default="default")
+
+
+@tool
+def whoami(call: int) -> str:
+    """Return the current user."""
+    return f"{call}:{user.get()}"
+
+
+MESSAGE = AIMessage(
+    "",
+    tool_calls=[
+        {"name": "whoami", "args": {"call": i}, "id": str(i)} for i in range(3)
+    ],
+)
+
+
+def test_invoked_alone():
+    node = ConcurrentToolNode([whoami])
+    messages = node.invoke({"messages": [MESSAGE]})["messages"]
+    assert [m.content for m in messages] == ["0:default", "1:default", "2:default"]
+    messages = asyncio.run(node.ainvoke({"messages": [MESSAGE]}))["messages"]
+    assert [m.content for m in messages] == ["0:default", "1:default", "2:default"]
+
+
+@pytest.mark.filterwarnings("ignore::langchain_core._api.beta_decorator.LangChainBetaWarning")
+def test_calls_keep_the_context_and_dispatch_events():
+    node = ConcurrentToolNode([whoami])
+    parent = RunnableLambda(lambda state, config: node.invoke(state, config))
+
+    async def run():
+        user.set("alice")
+        events = [
+            event
+            async for event in parent.astream_events({"messages": [MESSAGE]}, version="v2")
+            if event["event"] == "on_custom_event"
+        ]
+        return events
+
+    events = asyncio.run(run())
+    assert sorted(event["data"].content for event in events if event["name"] == TOOL_RESULT_EVENT) == [
+        "0:alice",
+        "1:alice",
+        "2:alice",
+    ]
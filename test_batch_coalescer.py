@@ -0,0 +1,88 @@
+import asyncio
+
+import httpx
+
+from batch_coalescer import BatchCoalescer
+from prepare import EndpointIndex
+from spec_loader import load_spec
+
+
+def test_only_same_shape_batches_are_coalesced():
+    coalescer = BatchCoalescer(EndpointIndex(load_spec("spotify_openapi.yaml").api_spec))
+    base = "https://api.spotify.com/v1"
+    assert coalescer.route(f"{base}/tracks/4uLU6hMCjMI75M1A2tKUQC").name == "GET /tracks"
+    assert coalescer.route(f"{base}/artists/0OdUWJ0sBjDrqHygGUXeCF").name == "GET /artists"
+    # GET /shows?ids= returns simplified shows, without their episodes
+    assert coalescer.route(f"{base}/shows/38bS44xjbVVZ3No3ByF1dJ") is None
+
+
+BASE = "https://api.spotify.com/v1"
+
+
+def _coalescer():
+    return BatchCoalescer(EndpointIndex(load_spec("spotify_openapi.yaml").api_spec))
+
+
+def _send(calls, answer):
+    async def send(method, url, params=None, headers=None):
+        calls.append((url, dict(params or {})))
+        ids = params["ids"].split(",")
+        return httpx.Response(200, json=answer(ids), request=httpx.Request(method, url))
+
+    return send
+
+
+def test_single_id_gets_are_merged_and_fanned_out():
+    calls = []
+    # The batch answers null for IDs it does not know
+    send = _send(calls, lambda ids: {"tracks": [None if i == "gone" else {"id": i} for i in ids]})
+    coalescer = _coalescer()
+    ids = ["a", "b", "gone", "c"]
+
+    async def run():
+        responses = await asyncio.gather(
+            *(coalescer.get(send, f"{BASE}/tracks/{i}", {"market": "SE"}, {}) for i in ids)
+        )
+        assert not coalescer._flushes
+        return responses
+
+    responses = asyncio.run(run())
+    assert calls == [(f"{BASE}/tracks", {"market": "SE", "ids": "a,b,gone,c"})]
+    assert [r.status_code for r in responses] == [200, 200, 404, 200]
+    assert [r.json().get("id") for r in responses] == ["a", "b", None, "c"]
+    assert coalescer.requests == 4 and coalescer.batches == 1
+
+
+def test_contains_requests_get_their_own_slices():
+    calls = []
+    send = _send(calls, lambda ids: [i.startswith("saved") for i in ids])
+    coalescer = _coalescer()
+    url = f"{BASE}/me/tracks/contains"
+
+    async def run():
+        return await asyncio.gather(
+            coalescer.get(send, url, {"ids": "saved1,x"}, {}),
+            coalescer.get(send, f"{url}?ids=y", None, {}),
+            coalescer.get(send, url, {"ids": "saved2,saved3,z"}, {}),
+        )
+
+    responses = asyncio.run(run())
+    assert calls == [(url, {"ids": "saved1,x,y,saved2,saved3,z"})]
+    assert [r.json() for r in responses] == [[True, False], [False], [True, True, False]]
+
+
+def test_batches_are_cut_at_the_endpoint_maximum():
+    calls = []
+    send = _send(calls, lambda ids: {"albums": [{"id": i} for i in ids]})
+    coalescer = _coalescer()
+    ids = [str(i) for i in range(25)]
+
+    async def run():
+        return await asyncio.gather(
+            *(coalescer.get(send, f"{BASE}/albums/{i}", None, {}) for i in ids)
+        )
+
+    responses = asyncio.run(run())
+    # GET /albums takes at most 20 IDs
+    assert [len(params["ids"].split(",")) for _, params in calls] == [20, 5]
+    assert [r.json()["id"] for r in responses] == ids
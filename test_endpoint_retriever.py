@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from endpoint_retriever import EndpointRetriever, recall_at_k
+from spec_loader import load_spec
+
+# What the planner always gets next to the retrieved endpoints
+ALWAYS_INCLUDED = ("GET /me", "GET /search")
+
+
+@pytest.fixture(scope="module")
+def retriever(tmp_path_factory):
+    spotify_spec = load_spec("spotify_openapi.yaml")
+    return EndpointRetriever(
+        spotify_spec.api_spec,
+        spotify_spec.spec_hash,
+        cache_dir=str(tmp_path_factory.mktemp("cache")),
+    )
+
+
+def test_recall_at_default_k(retriever):
+    # ENDPOINTS_TOP_K defaults to 15
+    assert recall_at_k(retriever, 15, always_include=ALWAYS_INCLUDED) >= 0.95
+
+
+def test_recall_grows_with_k(retriever):
+    recalls = [recall_at_k(retriever, k) for k in (5, 10, 15, 20, 30)]
+    assert recalls == sorted(recalls)
+
+
+def test_index_is_loaded_from_disk(retriever):
+    results = retriever.search("pause the music", 5)
+    assert os.path.exists(retriever.path)
+    reloaded = EndpointRetriever(
+        retriever.api_spec,
+        load_spec("spotify_openapi.yaml").spec_hash,
+        cache_dir=os.path.dirname(retriever.path),
+    )
+    assert reloaded.path == retriever.path
+    assert reloaded.search("pause the music", 5) == results
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.pydantic_v1 import ValidationError
+
+from math_tools import _evaluate_expression, evaluate_batch, get_math_tool
+
+# Pairs of expressions sharing a template, so each pair is evaluated as a batch
+EDGE_CASES = [
+    "2 ** -1",
+    "3 ** -2",
+    "2 ** (1 - 3)",
+    "5 ** (1 - 3)",
+    "10 ** 20",
+    "11 ** 20",
+    "1 / 0",
+    "0 / 0",
+    "7 / 2",
+    "9 / 2",
+    "3000000000 * 4",
+    "3000000001 * 4",
+    "4611686018427387904 * 2",
+    "4611686018427387903 * 1",
+    "2 ** 62 * 4",
+    "3 ** 30 * 2",
+    "1.5e308 * 10",
+    "2e308 * 1",
+    "sqrt(4) * 3",
+    "sqrt(9) * 3",
+    "7 % 2",
+    "9 % 4",
+]
+
+
+def _scalar(expression):
+    try:
+        return _evaluate_expression(expression)
+    except ValueError as e:
+        return e
+
+
+@pytest.mark.parametrize(
+    "expression,result", list(zip(EDGE_CASES, evaluate_batch(EDGE_CASES)))
+)
+def test_batch_matches_scalar(expression, result):
+    expected = _scalar(expression)
+    if isinstance(expected, ValueError):
+        assert isinstance(result, ValueError)
+        assert str(result) == str(expected)
+    else:
+        assert type(result) is type(expected)
+        assert result == expected
+
+
+def test_batch_keeps_order_across_templates():
+    expressions = ["1 + 2", "2 ** -1", "3 + 4", "1 / 0", "2 ** -2"]
+    assert [str(r) for r in evaluate_batch(expressions)] == [
+        str(_scalar(expression)) for expression in expressions
+    ]
+
+
+class _Runs(BaseCallbackHandler):
+    def __init__(self):
+        self.started, self.ended, self.errors = [], [], []
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.started.append(input_str)
+
+    def on_tool_end(self, output, **kwargs):
+        self.ended.append(output)
+
+    def on_tool_error(self, error, **kwargs):
+        self.errors.append(error)
+
+
+@pytest.mark.filterwarnings("ignore::langchain_core._api.LangChainDeprecationWarning")
+def test_batch_is_one_tool_run_per_problem():
+    # Plain expressions never reach the LLM
+    tool = get_math_tool(FakeListChatModel(responses=[]))
+    runs = _Runs()
+    inputs = [{"problem": "1 + 3"}, "2 * 4", {"problem": "1", "context": 5}]
+    results = tool.batch(inputs, {"callbacks": [runs]}, return_exceptions=True)
+
+    assert results[:2] == [4, 8]
+    assert isinstance(results[2], ValidationError)
+    assert len(runs.started) == 3
+    assert runs.ended == [4, 8]
+    assert runs.errors == [results[2]]
+    with pytest.raises(ValidationError):
+        tool.batch(inputs)
+    assert asyncio.run(tool.abatch(inputs[:2], {"callbacks": [runs]})) == [4, 8]
+    assert len(runs.started) == 5
@@ -0,0 +1,112 @@
+import os
+import random
+
+import pytest
+
+from bench_output_parser import TOOLS, benchmark, plan_tokens
+from output_parser import LLMCompilerPlanParser, _parse_llm_compiler_action_args
+
+MATH, SEARCH = TOOLS
+
+
+def test_keyword_and_positional_args():
+    assert _parse_llm_compiler_action_args('"1 + 3"', MATH) == {"problem": "1 + 3"}
+    assert _parse_llm_compiler_action_args(
+        'problem="age of $1, in years", context=["$1", "${2}"]', MATH
+    ) == {"problem": "age of $1, in years", "context": ["$1", "${2}"]}
+    assert _parse_llm_compiler_action_args(
+        'context=["$1"], problem="x = 1"', MATH
+    ) == {"context": ["$1"], "problem": "x = 1"}
+
+
+def test_apostrophe_in_unquoted_value():
+    assert _parse_llm_compiler_action_args(
+        "problem=what's 2+2, context=[\"$1\"]", MATH
+    ) == {"problem": "what's 2+2", "context": ["$1"]}
+    assert _parse_llm_compiler_action_args('query=Sam\'s "best" songs', SEARCH) == {
+        "query": 'Sam\'s "best" songs'
+    }
+
+
+def test_quotes_inside_brackets():
+    assert _parse_llm_compiler_action_args(
+        "problem=\"a\", context=[\"it's ]\", '$1, $2']", MATH
+    ) == {"problem": "a", "context": ["it's ]", "$1, $2"]}
+
+
+def test_arg_names_are_cached_per_parser():
+    parser = LLMCompilerPlanParser(tools=[MATH])
+    parser.parse('1. math("1 + 3")\n')
+    assert parser._arg_names == {"math": ("problem", "context")}
+    assert LLMCompilerPlanParser(tools=[MATH])._arg_names == {}
+
+
+# Fuzz: random values round-trip through the planner's argument syntax
+
+_PIECES = [
+    "a", "b=c", ", ", "(", ")", "[", "]", "{", "}", "'", '"', "\\", "$1", "${2}",
+    "what's", "x = 1", "problem=", "context", "#1", "10%", " ",
+]
+
+
+def _random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(_PIECES) for _ in range(rng.randint(0, 8)))
+
+
+def _random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(5 if depth < 2 else 3)
+    if kind == 0:
+        return _random_text(rng)
+    if kind == 1:
+        return rng.randint(-1000, 1000)
+    if kind == 2:
+        return round(rng.uniform(-1000, 1000), 3)
+    if kind == 3:
+        return [_random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    return {_random_text(rng): _random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))}
+
+
+def test_fuzz_round_trip():
+    rng = random.Random(0)
+    for _ in range(5000):
+        expected = {"problem": _random_value(rng)}
+        if rng.random() < 0.7:
+            expected["context"] = [_random_value(rng) for _ in range(rng.randint(0, 3))]
+        names = list(expected)
+        if rng.random() < 0.5:
+            rng.shuffle(names)
+        positional = rng.random() < 0.3 and names == ["problem", "context"][: len(names)]
+        args = ", ".join(
+            repr(expected[name]) if positional else f"{name}={expected[name]!r}"
+            for name in names
+        )
+        assert _parse_llm_compiler_action_args(args, MATH) == expected, args
+
+
+# literal_eval warns about the escapes of the junk it is given
+@pytest.mark.filterwarnings("ignore::DeprecationWarning", "ignore::SyntaxWarning")
+def test_fuzz_never_raises():
+    rng = random.Random(1)
+    for _ in range(5000):
+        args = _random_text(rng) + _random_text(rng)
+        result = _parse_llm_compiler_action_args(args, MATH)
+        assert set(result) <= {"problem", "context"}
+
+
+# Long plans streamed token by token, timings are left to bench_output_parser.py
+
+
+def test_long_streamed_plan():
+    parser = LLMCompilerPlanParser(tools=TOOLS)
+    tasks = list(parser._transform(iter(plan_tokens(5000))))
+    assert [task["idx"] for task in tasks] == list(range(1, 5001))
+    assert tasks[2]["args"] == {"query": "Play It Again, Sam (1972) = cast, 'Woody Allen'"}
+
+
+@pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"), reason="wall-clock timing, set RUN_BENCHMARKS=1"
+)
+def test_parse_time_is_linear_in_plan_length():
+    # Re-joining the buffer on every line made long plans quadratic
+    short, long = benchmark(500), benchmark(5000)
+    assert long / 5000 < 3 * short / 500
@@ -0,0 +1,95 @@
+import asyncio
+import json
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+from paginator import Paginator
+
+PAGING_SCHEMA = {"type": "object", "properties": {"items": {}, "next": {}, "total": {}}}
+TOTAL = 500
+
+
+class _EndpointIndex:
+    def find_url(self, method, url):
+        return "GET /me/playlists"
+
+    def response_schema(self, name):
+        return PAGING_SCHEMA
+
+
+def _pages(params=None, max_items=200):
+    requests = []
+
+    async def send(method, url, headers=None, params=None):
+        query = {**dict(parse_qsl(urlsplit(url).query)), **(params or {})}
+        requests.append(query)
+        offset, limit = int(query.get("offset", 0)), int(query["limit"])
+        items = list(range(offset, min(offset + limit, TOTAL)))
+        body = {"items": items, "next": "https://api/next", "total": TOTAL}
+        return httpx.Response(200, content=json.dumps(body).encode())
+
+    async def collect():
+        paginator = Paginator(_EndpointIndex(), max_items=max_items)
+        url = "https://api.spotify.com/v1/me/playlists"
+        return [
+            item
+            async for item in paginator.iter_items(send, url, params, {})
+        ]
+
+    return asyncio.run(collect()), requests
+
+
+def test_last_page_is_clamped_to_the_limit():
+    items, requests = _pages({"limit": "120"})
+    assert items == list(range(120))
+    assert [request["limit"] for request in requests] == ["50", "50", "20"]
+
+
+def test_max_items_caps_the_pages():
+    items, requests = _pages(max_items=20)
+    assert items == list(range(20))
+    assert len(requests) == 1
+
+
+def test_invalid_limit_falls_back_to_the_default():
+    items, _ = _pages({"limit": "all"}, max_items=60)
+    assert items == list(range(60))
+
+
+def test_wrapper_fetches_every_page_and_serves_later_pages_from_the_buffer():
+    from http_client import AsyncRequestsWrapper
+
+    requests = []
+
+    def handler(request):
+        query = dict(request.url.params)
+        requests.append(query)
+        offset, limit = int(query.get("offset", 0)), int(query["limit"])
+        items = list(range(offset, min(offset + limit, TOTAL)))
+        body = {"items": items, "next": "https://api/next", "offset": offset, "total": TOTAL}
+        return httpx.Response(200, json=body)
+
+    async def run():
+        wrapper = AsyncRequestsWrapper(paginator=Paginator(_EndpointIndex(), max_items=5000))
+        loop = asyncio.get_running_loop()
+        wrapper._pool._async_clients[loop] = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler)
+        )
+        url = "https://api.spotify.com/v1/me/playlists"
+        first = json.loads(await wrapper.aget(url))
+        fetched = len(requests)
+        second = json.loads(await wrapper.aget(url, params={"offset": 50, "limit": 50}))
+        await wrapper.aclose()
+        return first, fetched, second
+
+    first, fetched, second = asyncio.run(run())
+    assert first["items"] == list(range(TOTAL))
+    assert fetched == TOTAL // 50
+    assert sorted(int(request.get("offset", 0)) for request in requests) == list(
+        range(0, TOTAL, 50)
+    )
+    # The agent's next page comes from the buffer, not the API
+    assert len(requests) == fetched
+    assert second["items"] == list(range(50, 100))
+    assert second["next"].endswith("offset=100&limit=50")
@@ -0,0 +1,25 @@
+from plan_cache import PlanCache
+
+PLAN = {"plan": ["Find the kitchen playlist", "Add the song to it"]}
+
+
+def _cache(tmp_path, **kwargs):
+    return PlanCache("spec", path=str(tmp_path / "plans.sqlite3"), **kwargs)
+
+
+def test_exact_match_only_without_embedding(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put("Add As Time Goes By to my kitchen playlist, please", PLAN)
+    assert cache.get("add as time goes by to my KITCHEN playlist please") == PLAN
+    # Bags of words would rate these 0.97 alike
+    assert cache.get("Add As Time Goes By to my bedroom playlist, please") is None
+    assert cache.stats()["similar_hits"] == 0
+
+
+def test_similar_match_with_embedding(tmp_path):
+    vectors = {"play casablanca songs": [1.0, 0.0], "play songs from casablanca": [0.99, 0.1]}
+    cache = _cache(tmp_path, embed=lambda query: vectors.get(query, [0.0, 1.0]))
+    cache.put("Play Casablanca songs", PLAN)
+    assert cache.get("Play songs from Casablanca") == PLAN
+    assert cache.get("Stop the music") is None
+    assert cache.stats()["similar_hits"] == 1
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from http_client import AsyncRequestsWrapper
+from rate_limiter import RateLimiter, parse_retry_after
+
+RETRY_AFTER = 0.2
+
+
+class _StubServer:
+    """Local HTTP server answering 429 with Retry-After to the first `limited` requests."""
+
+    def __init__(self, limited: int):
+        self.limited = limited
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(time.monotonic())
+                if len(stub.requests) <= stub.limited:
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(RETRY_AFTER))
+                    body = b'{"error": {"status": 429, "message": "API rate limit exceeded"}}'
+                else:
+                    self.send_response(200)
+                    body = b'{"ok": true}'
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/me"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(request):
+    server = _StubServer(getattr(request, "param", 2))
+    yield server
+    server.close()
+
+
+def _wrapper(rate_limiter):
+    return AsyncRequestsWrapper(rate_limiter=rate_limiter, http2=False)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None, default=1.5) == 1.5
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_429s_are_retried_after_retry_after(stub):
+    limiter = RateLimiter()
+    wrapper = _wrapper(limiter)
+    start = time.monotonic()
+    response = wrapper.request("GET", stub.url)
+    wrapper.close()
+
+    assert response.status_code == 200
+    assert len(stub.requests) == 3
+    # Each retry waited for the Retry-After delay of the 429 before it
+    for earlier, later in zip(stub.requests, stub.requests[1:]):
+        assert later - earlier >= RETRY_AFTER
+    assert time.monotonic() - start >= 2 * RETRY_AFTER
+    stats = limiter.stats()
+    assert stats["throttled"] == 2
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] >= 1
+
+
+@pytest.mark.parametrize("stub", [10], indirect=True)
+def test_429_is_returned_after_max_retries(stub):
+    limiter = RateLimiter(max_retries=2)
+    wrapper = _wrapper(limiter)
+    response = wrapper.request("GET", stub.url)
+    wrapper.close()
+
+    assert response.status_code == 429
+    assert len(stub.requests) == 3
+    assert limiter.stats()["throttled"] == 2
+
+
+def test_async_requests_queue_behind_a_429(stub):
+    # Enough budget for every request, only the 429s make them wait
+    limiter = RateLimiter(rate=100, burst=100, endpoint_rate=100, endpoint_burst=100)
+    wrapper = _wrapper(limiter)
+    depths = []
+
+    async def run():
+        async def watch():
+            while True:
+                depths.append(limiter.stats()["queue_depth"])
+                await asyncio.sleep(0.01)
+
+        watcher = asyncio.create_task(watch())
+        responses = await asyncio.gather(*(wrapper.aget(stub.url) for _ in range(5)))
+        watcher.cancel()
+        await wrapper.aclose()
+        return responses
+
+    responses = asyncio.run(run())
+    assert all('"ok"' in response for response in responses)
+    stats = limiter.stats()
+    # Both 429s were retried, the requests after them waited in the queue
+    assert stats["throttled"] == 2
+    assert len(stub.requests) == 7
+    assert max(depths) >= 2
+    assert stats["max_queue_depth"] >= 2
+    assert stats["queue_depth"] == 0
+    assert stats["waited"] >= RETRY_AFTER
+
+
+@pytest.mark.parametrize("stub", [0], indirect=True)
+def test_token_buckets_pace_requests(stub):
+    limiter = RateLimiter(rate=10, burst=1, endpoint_rate=10, endpoint_burst=1)
+    wrapper = _wrapper(limiter)
+
+    async def run():
+        start = time.monotonic()
+        await asyncio.gather(*(wrapper.aget(stub.url) for _ in range(4)))
+        elapsed = time.monotonic() - start
+        await wrapper.aclose()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    # One request right away, then one every 0.1 s
+    assert elapsed >= 0.29
+    assert limiter.stats()["waited"] >= 0.25
+    assert limiter.stats()["max_queue_depth"] == 3
+    assert limiter.stats()["throttled"] == 0
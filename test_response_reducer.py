@@ -0,0 +1,47 @@
+import json
+
+from response_reducer import ResponseReducer
+
+TRACK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "string"},
+        "name": {"type": "string"},
+        "images": {"type": "array", "items": {"type": "object"}},
+    },
+}
+
+
+class _EndpointIndex:
+    """The two lookups ResponseReducer makes, for a single endpoint."""
+
+    def find_url(self, method, url):
+        return "GET /tracks/{id}" if method == "GET" and "/tracks/" in url else None
+
+    def response_schema(self, name):
+        return TRACK_SCHEMA
+
+
+URL = "https://api.spotify.com/v1/tracks/1"
+
+
+def _reduce(body, status_code=None):
+    reducer = ResponseReducer(_EndpointIndex())
+    return json.loads(reducer.reduce("GET", URL, json.dumps(body), 10000, status_code))
+
+
+def test_success_is_projected():
+    body = {"id": "1", "name": "As Time Goes By", "images": [{"url": "x"}], "extra": 1}
+    assert _reduce(body, 200) == {"id": "1", "name": "As Time Goes By"}
+
+
+def test_error_body_is_kept():
+    body = {"error": {"status": 401, "message": "The access token expired"}}
+    assert _reduce(body) == body
+    assert _reduce(body, 401) == body
+
+
+def test_non_2xx_is_kept():
+    body = {"id": "1", "message": "Not found", "images": []}
+    assert _reduce(body, 404) == body
+    assert _reduce({"message": "Too many requests"}, 429) == {"message": "Too many requests"}
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.tools import StructuredTool
+
+from math_tools import MathTool
+from scheduler import _execute_task, _resolve_args, schedule_tasks
+
+
+def _echo(problem: str, context: Optional[List[Any]] = None) -> dict:
+    """Return the arguments as received."""
+    return {"problem": problem, "context": context}
+
+
+ECHO = StructuredTool.from_function(_echo, name="math")
+OBSERVATIONS = {1: np.array([1.5, 2.5]), 2: 0.1 + 0.2, 3: "Casablanca"}
+
+
+def _task(args):
+    return {"idx": 4, "tool": ECHO, "args": args, "dependencies": [1, 2, 3], "thought": None}
+
+
+def test_typed_values_only_reach_non_str_fields():
+    resolved = _resolve_args(_task({"problem": "$1", "context": ["$1", "$2", "$3"]}), OBSERVATIONS)
+    assert resolved["problem"] == "1.5 2.5"
+    array, number, text = resolved["context"]
+    assert array is OBSERVATIONS[1]
+    assert number == 0.1 + 0.2
+    assert text == "Casablanca"
+
+
+def test_embedded_references_are_text():
+    resolved = _resolve_args(_task({"problem": "$2 * 2", "context": ["total $1"]}), OBSERVATIONS)
+    assert resolved == {"problem": "0.30000000000000004 * 2", "context": ["total 1.5 2.5"]}
+
+
+def test_array_reference_to_str_field_runs():
+    result = _execute_task(_task({"problem": "$1"}), OBSERVATIONS, {})
+    assert result == {"problem": "1.5 2.5", "context": None}
+
+
+def _batched_math(ran: threading.Event) -> MathTool:
+    def solve(problem: str, context: Optional[List[Any]] = None) -> str:
+        """Solve a math problem."""
+        ran.set()
+        return problem
+
+    def solve_batch(problems, config=None):
+        return [solve(**problem) for problem in problems]
+
+    return MathTool.from_function(solve, name="math", batch_func=solve_batch)
+
+
+def test_held_math_task_starts_when_the_plan_stalls():
+    ran = threading.Event()
+    math = _batched_math(ran)
+    started_before_next_task = []
+
+    def plan():
+        yield {"idx": 1, "tool": math, "args": {"problem": "1 + 1"}, "dependencies": [], "thought": None}
+        # The planner is slow to produce the next task
+        started_before_next_task.append(ran.wait(5))
+
+    messages = schedule_tasks.invoke({"messages": [], "tasks": plan()})
+    assert started_before_next_task == [True]
+    assert [message.content for message in messages] == ["1 + 1"]
+
+
+def test_held_math_task_starts_when_the_async_plan_stalls():
+    ran = threading.Event()
+    math = _batched_math(ran)
+    started_before_next_task = []
+
+    async def plan():
+        yield {"idx": 1, "tool": math, "args": {"problem": "1 + 1"}, "dependencies": [], "thought": None}
+        for _ in range(500):
+            if ran.is_set():
+                break
+            await asyncio.sleep(0.01)
+        started_before_next_task.append(ran.is_set())
+
+    messages = asyncio.run(schedule_tasks.ainvoke({"messages": [], "tasks": plan()}))
+    assert started_before_next_task == [True]
+    assert [message.content for message in messages] == ["1 + 1"]
@@ -0,0 +1,245 @@
+import contextvars
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+TOKEN_STORE_PATH = ".tokens"
+TOKEN_KEY_PATH = ".tokens.key"
+
+# User the requests of the current task or thread are made for
+current_user: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_user", default="default"
+)
+
+
+class AuthorizationRequired(Exception):
+    """The user has no token yet and must go through the OAuth flow."""
+
+    def __init__(self, user_id: str, authorize_url: str):
+        super().__init__(f"User {user_id!r} must authorize at {authorize_url}")
+        self.user_id = user_id
+        self.authorize_url = authorize_url
+
+
+class EncryptedTokenStore:
+    """Token infos of every user in one Fernet-encrypted JSON file.
+
+    The key is read from the `TOKEN_STORE_KEY` environment variable, or from
+    `key_path`, which is created with owner-only permissions on first use.
+    """
+
+    def __init__(
+        self,
+        path: str = TOKEN_STORE_PATH,
+        key: Optional[bytes] = None,
+        key_path: str = TOKEN_KEY_PATH,
+    ):
+        if Fernet is None:
+            raise ImportError(
+                "Could not import cryptography python package. "
+                "Please install it with `pip install cryptography`."
+            )
+        self.path = path
+        self._fernet = Fernet(key or self._load_key(key_path))
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Dict[str, Any]] = self._read()
+
+    @staticmethod
+    def _load_key(key_path: str) -> bytes:
+        key = os.environ.get("TOKEN_STORE_KEY")
+        if key:
+            return key.encode()
+        try:
+            with open(key_path, "rb") as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            key = Fernet.generate_key()
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as file:
+                file.write(key)
+            return key
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "rb") as file:
+                return json.loads(self._fernet.decrypt(file.read()))
+        except FileNotFoundError:
+            return {}
+        except InvalidToken:
+            # Key changed, the users authorize again
+            return {}
+
+    def _write(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(self._fernet.encrypt(json.dumps(self._tokens).encode()))
+        os.replace(tmp_path, self.path)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._tokens.get(user_id)
+
+    def set(self, user_id: str, token_info: Dict[str, Any]) -> None:
+        with self._lock:
+            self._tokens[user_id] = token_info
+            self._write()
+
+    def users(self) -> List[str]:
+        with self._lock:
+            return list(self._tokens)
+
+
+class _UserCacheHandler(CacheHandler):
+    """Lets spotipy read and save one user's token in the shared store."""
+
+    def __init__(self, store: EncryptedTokenStore, user_id: str):
+        self.store = store
+        self.user_id = user_id
+
+    def get_cached_token(self):
+        return self.store.get(self.user_id)
+
+    def save_token_to_cache(self, token_info):
+        self.store.set(self.user_id, token_info)
+
+
+class TokenManager:
+    """Per-user Spotify access tokens, refreshed ahead of expiry.
+
+    `headers()` returns the Authorization header of `current_user` and is
+    meant as the `header_provider` of an `AsyncRequestsWrapper`, so one
+    wrapper and its tools serve every user. A background thread refreshes
+    tokens `refresh_margin` seconds before they expire, so requests never
+    wait for a refresh. Client id, secret and redirect URI are read by
+    spotipy from the `SPOTIPY_*` environment variables.
+
+    The `state` of an authorization URL is a random nonce, mapped to its user
+    on the server for `authorization_ttl` seconds. The redirect's `state` is
+    resolved with `user_for_state`, so a callback can only store a token for
+    the user the URL was issued to.
+    """
+
+    def __init__(
+        self,
+        scopes: List[str],
+        store: EncryptedTokenStore,
+        refresh_margin: float = 300.0,
+        oauth_factory: Optional[Callable[..., SpotifyOAuth]] = None,
+        authorization_ttl: float = 600.0,
+    ):
+        self.scope = ",".join(scopes)
+        self.store = store
+        self.refresh_margin = refresh_margin
+        self.oauth_factory = oauth_factory or SpotifyOAuth
+        self.authorization_ttl = authorization_ttl
+
+        # OAuth state nonce -> (user id, expiry) of the authorizations started
+        self._states: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _oauth(self, user_id: str) -> SpotifyOAuth:
+        return self.oauth_factory(
+            scope=self.scope,
+            cache_handler=_UserCacheHandler(self.store, user_id),
+            open_browser=False,
+        )
+
+    def _lock(self, user_id: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def authorize_url(self, user_id: str) -> str:
+        """URL the user opens to grant access, with a fresh `state` nonce."""
+        state = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._locks_lock:
+            for expired in [key for key, (_, expires) in self._states.items() if expires <= now]:
+                del self._states[expired]
+            self._states[state] = (user_id, now + self.authorization_ttl)
+        return self._oauth(user_id).get_authorize_url(state=state)
+
+    def user_for_state(self, state: str) -> Optional[str]:
+        """User an authorization `state` was issued to, each state is used once."""
+        with self._locks_lock:
+            user_id, expires = self._states.pop(state, (None, 0.0))
+        return user_id if expires > time.time() else None
+
+    def complete_authorization(self, user_id: str, code: str) -> None:
+        """Exchange the code sent to the redirect URI for a token."""
+        self._oauth(user_id).get_access_token(code, as_dict=False, check_cache=False)
+
+    def authorize(self, user_id: str = "default") -> None:
+        """Prompt for authorization on the terminal unless a token is stored."""
+        if self.store.get(user_id) is None:
+            oauth = self._oauth(user_id)
+            self.complete_authorization(user_id, oauth.get_auth_response())
+
+    def _refresh(self, user_id: str, token_info: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock(user_id):
+            # Another thread may have refreshed while we waited
+            current = self.store.get(user_id) or token_info
+            if current["expires_at"] - time.time() > self.refresh_margin:
+                return current
+            return self._oauth(user_id).refresh_access_token(current["refresh_token"])
+
+    def access_token(self, user_id: str) -> str:
+        token_info = self.store.get(user_id)
+        if token_info is None:
+            raise AuthorizationRequired(user_id, self.authorize_url(user_id))
+        if token_info["expires_at"] - time.time() <= self.refresh_margin:
+            # Only happens when the background refresh is late or not started
+            token_info = self._refresh(user_id, token_info)
+        return token_info["access_token"]
+
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.access_token(current_user.get())}"}
+
+    def refresh_due(self) -> float:
+        """Refresh tokens expiring soon, return the seconds until the next one is due."""
+        next_due = self.refresh_margin
+        for user_id in self.store.users():
+            token_info = self.store.get(user_id)
+            remaining = token_info["expires_at"] - time.time() - self.refresh_margin
+            if remaining <= 0:
+                try:
+                    token_info = self._refresh(user_id, token_info)
+                except Exception:
+                    # Retried on the next round, or on the user's next request
+                    continue
+                remaining = token_info["expires_at"] - time.time() - self.refresh_margin
+            next_due = min(next_due, remaining)
+        return max(next_due, 1.0)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_due()):
+            pass
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="token-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None